@@ -0,0 +1,320 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtureEnv
+from fakeServices import FakeBrowse, FakeInventory, FakeServer, FakeSlack
+
+# Full refresh cycles and search workloads through the real lambda handlers, against the fake BC Liquor site, moto (or
+# DynamoDB Local) and a fake Slack. Each catalogue size runs in a fresh process so its peak memory is its own.
+# Per size it runs:
+#   - a cold refresh (every sku new)
+#   - a warm refresh after STOCK_CHANGES of the browse listings changed
+#   - searches going in through the Slack handler, the invoke it makes run by the search function
+# Reports throughput, p50/p99 latency and peak RSS (what Lambda reports as Max Memory Used). With moto the table is kept
+# in this process too, so the peaks include the items it stores, and its scans take about 1ms an item so they make up
+# most of the cold search (index build) and the purge. Only compare against baselines taken with the same backend.
+# Results can be saved as a baseline and later runs compared against it, exits with 1 if anything got worse by more
+# than the tolerance
+# e.g. python benchmarks/benchEndToEnd.py --sizes 1000 10000 --save
+#      python benchmarks/benchEndToEnd.py --sizes 1000 10000 --tolerance 0.3
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'endToEnd.json')
+STOCK_CHANGES = 0.05  # Share of browse listings whose availableUnits change before the warm refresh
+TERMS = ['all', 'beer', 'ipa', 'gin', 'vodka', 'red wine', 'island lager', 'hazy', 'whsky', 'golden ale', 'cider', 'pacific reserve']
+STORES = ['218', '178', '82', '161', '140']
+MIN_CHANGE_MS = 1.0  # Latency changes smaller than this are noise, not regressions
+
+
+class Context:
+    # The bits of the Lambda context the handlers use
+    invoked_function_arn = 'arn:aws:lambda:us-west-2:123456789012:function:cache'
+
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+
+class PeakRSS:
+    # Highest resident set size while the block runs, sampled from /proc every few milliseconds. Falls back to the
+    # process' lifetime peak where there is no /proc
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def sample(self):
+        while not self.stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self.stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.current())
+
+    @property
+    def mb(self):
+        return round(self.peak / 2**20, 1)
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def search_event(rng, response_url):
+    # A view_submission the way API Gateway hands it over, with a random term, stores, price and sometimes weights
+    from benchSlackHandler import interactivity_event
+    values = {
+        'search': {'query': {'type': 'plain_text_input', 'value': rng.choice(TERMS)}},
+        'stores': {'selected_stores': {'type': 'multi_static_select',
+                                       'selected_options': [{'value': store} for store in rng.sample(STORES, rng.randint(1, 3))]}},
+        'max_price': {'max_price': {'type': 'plain_text_input', 'value': str(rng.choice([0, rng.randint(10, 80)]))}},
+    }
+    if rng.random() < 0.25:
+        values['value_weight'] = {'value_weight': {'type': 'plain_text_input', 'value': str(round(rng.uniform(0.2, 1), 1))}}
+    return interactivity_event({'type': 'view_submission', 'trigger_id': '1.2.3', 'view': {'state': {'values': values}},
+                                'response_urls': [{'response_url': response_url}]})
+
+
+def phases(record):
+    # Phase times (ms) out of a metrics record
+    return {key[:-len('_ms')]: value for key, value in record.items() if key.endswith('_ms')}
+
+
+def refresh(cache, records):
+    with PeakRSS() as rss:
+        t = time.perf_counter()
+        summary = cache.lambda_handler({}, Context())
+        seconds = time.perf_counter() - t
+    record = records.pop()
+    return {
+        'seconds': round(seconds, 2),
+        'listings_per_s': round(record.get('listings', 0) / seconds, 1),
+        'peak_rss_mb': rss.mb,
+        'inventory_requests': record.get('inventory_requests', 0),
+        'items_written': record.get('dynamodb_items_written', 0),
+        'remaining': summary['remaining'] if summary is not None else None,
+        'phases_ms': phases(record),
+    }
+
+
+def search(slackHandler, dbSearch, invoker, events, records):
+    # Each event goes through the Slack handler, then the search invoke it queued is run the way Lambda would
+    acks, searches = [], []
+    with PeakRSS() as rss:
+        started = time.perf_counter()
+        for i, event in enumerate(events):
+            if i == 1:
+                # Throughput is over the warm searches, the first one builds the index
+                started = time.perf_counter()
+            t = time.perf_counter()
+            slackHandler.lambda_handler(event, None)
+            acks.append((time.perf_counter() - t) * 1000)
+
+            payload = invoker.payloads.pop()
+            t = time.perf_counter()
+            dbSearch.lambda_handler(payload, None)
+            searches.append((time.perf_counter() - t) * 1000)
+        seconds = time.perf_counter() - started
+
+    search_records = [record for record in records if record['Function'] == 'search']
+    del records[:]
+    # The first search builds the index, the rest are what a warm container sees
+    warm = searches[1:] or searches
+    warm_events = len(events) - 1 or len(events)
+    return {
+        'cold_ms': round(searches[0], 2),
+        'index_build_ms': search_records[0].get('index_build_ms'),
+        'p50_ms': round(percentile(warm, 0.5), 2),
+        'p99_ms': round(percentile(warm, 0.99), 2),
+        'searches_per_s': round(warm_events / seconds, 1),
+        'result_cache_hits': sum(record.get('result_cache_hits', 0) for record in search_records),
+        'peak_rss_mb': rss.mb,
+    }, {
+        'p50_ms': round(percentile(acks, 0.5), 2),
+        'p99_ms': round(percentile(acks, 0.99), 2),
+    }
+
+
+def run_size(size, searches, seed, dynamodb_endpoint):
+    # Runs in its own process, see main
+    os.environ.setdefault('INVENTORY_RATE', '100000')  # The fake site doesn't mind
+    os.environ.setdefault('MAX_INVENTORY_WORKERS', '16')
+    if dynamodb_endpoint:
+        os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = dynamodb_endpoint
+    fixtureEnv.apply()
+
+    browse = FakeBrowse(size, seed=seed)
+    slack = FakeSlack()
+    routes = {'/ajax/browse': browse, '/ajax/get-product-inventory': FakeInventory(seed=seed), '/api/': slack, '/hooks/': slack}
+    with contextlib.ExitStack() as stack:
+        if not dynamodb_endpoint:
+            from moto import mock_aws
+            stack.enter_context(mock_aws())
+        server = stack.enter_context(FakeServer(routes))
+        os.environ['SLACK_API_BASE'] = server.base_url + '/api/'
+        fresh_tables(dynamodb_endpoint)
+
+        import cache
+        import dbSearch
+        import imageCache
+        import inventoryRefresher
+        import metrics
+        import slackHandler
+        from benchSlackHandler import StubLambda
+
+        cache.url = server.base_url + '/ajax/browse'
+        inventoryRefresher.INVENTORY_URL = server.base_url + '/ajax/get-product-inventory?sku='
+        # Image checks go to BC Liquor's image server, which has no stand-in, so every image is taken as working
+        imageCache.image_exists = lambda session, image: True
+        invoker = slackHandler.lambda_client = StubLambda()
+        records = []
+        metrics.set_sink(records.append)
+
+        rng = random.Random(seed)
+        results = {'size': size}
+        # The handlers print a lot, none of which is wanted here
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            results['refresh_cold'] = refresh(cache, records)
+            for hit in rng.sample(browse.catalogue, int(len(browse.catalogue) * STOCK_CHANGES)):
+                hit['_source']['availableUnits'] = rng.choice([5, 50, 500])
+            browse.pages.clear()
+            results['refresh_warm'] = refresh(cache, records)
+
+            events = [search_event(rng, server.base_url + '/hooks/search') for _ in range(searches)]
+            results['search'], results['slack_ack'] = search(slackHandler, dbSearch, invoker, events, records)
+        results['slack_calls'] = slack.calls
+        return results
+
+
+def fresh_tables(dynamodb_endpoint):
+    import boto3
+    from benchWrites import create_tables
+    if dynamodb_endpoint:
+        # DynamoDB Local keeps its tables between runs
+        client = boto3.client('dynamodb')
+        for name in (os.environ['PRODUCT_TABLE'], os.environ['META_TABLE']):
+            if name in client.list_tables()['TableNames']:
+                client.delete_table(TableName=name)
+    create_tables()
+
+
+# Metrics where a bigger number is better, everything else compared is better smaller
+HIGHER_IS_BETTER = ('listings_per_s', 'searches_per_s')
+COMPARED = {
+    'refresh_cold': ('seconds', 'listings_per_s', 'peak_rss_mb'),
+    'refresh_warm': ('seconds', 'listings_per_s', 'peak_rss_mb'),
+    'search': ('cold_ms', 'p50_ms', 'p99_ms', 'searches_per_s', 'peak_rss_mb'),
+    'slack_ack': ('p50_ms', 'p99_ms'),
+}
+
+
+def regressions(baseline, results, tolerance):
+    # [(stage, metric, baseline value, new value)] for everything more than tolerance worse than the baseline
+    worse = []
+    for stage, keys in COMPARED.items():
+        for key in keys:
+            old, new = baseline.get(stage, {}).get(key), results[stage].get(key)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if key in HIGHER_IS_BETTER else (new - old) / old
+            if key.endswith('_ms') and new - old < MIN_CHANGE_MS:
+                continue
+            if change > tolerance:
+                worse.append((stage, key, old, new))
+    return worse
+
+
+def report(results):
+    size = results['size']
+    cold, warm, search, ack = results['refresh_cold'], results['refresh_warm'], results['search'], results['slack_ack']
+    for name, stage in (('refresh cold', cold), ('refresh warm', warm)):
+        print(f"{size:>7} {name:<13} {stage['seconds']:>9.2f}s {stage['listings_per_s']:>11.0f} listings/s {'':>21} "
+              f"{stage['peak_rss_mb']:>8.1f}MB  inventory requests {stage['inventory_requests']}, written {stage['items_written']}")
+    print(f"{size:>7} {'search':<13} {search['cold_ms'] / 1000:>9.2f}s {search['searches_per_s']:>11.0f} searches/s "
+          f"p50 {search['p50_ms']:>6.2f}ms p99 {search['p99_ms']:>6.2f}ms {search['peak_rss_mb']:>8.1f}MB  "
+          f"cold search incl. index build, {search['result_cache_hits']} result cache hits")
+    print(f"{size:>7} {'slack ack':<13} {'':>10} {'':>22} p50 {ack['p50_ms']:>6.2f}ms p99 {ack['p99_ms']:>6.2f}ms")
+    slowest = sorted(cold['phases_ms'].items(), key=lambda phase: -phase[1])[:5]
+    print(f"{'':>7} cold refresh phases: " + ', '.join(f"{phase} {ms / 1000:.2f}s" for phase, ms in slowest))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='catalogue sizes (skus)')
+    parser.add_argument('--searches', type=int, default=200, help='searches per size')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dynamodb-endpoint', help='use DynamoDB Local at this URL instead of moto')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='save these results to the baseline, replacing the sizes that were run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='how much worse than the baseline counts as a regression, 0.25 is 25%%')
+    args = parser.parse_args()
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Searches are generated from the seed and the result cache hits depend on how many there are
+    comparable = (baseline.get('searches', args.searches), baseline.get('seed', args.seed)) == (args.searches, args.seed)
+    if not comparable:
+        print(f"Not comparing against {args.baseline}, it was taken with {baseline['searches']} searches and seed {baseline['seed']}")
+
+    worse = []
+    runs = dict()
+    for size in args.sizes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            results = executor.submit(run_size, size, args.searches, args.seed, args.dynamodb_endpoint).result()
+        report(results)
+        runs[str(size)] = results
+
+        previous = baseline.get('sizes', {}).get(str(size)) if comparable else None
+        if previous is not None:
+            for stage, key, old, new in regressions(previous, results, args.tolerance):
+                print(f"{'':>7} REGRESSION {stage} {key}: {old} -> {new}")
+                worse.append((size, stage, key))
+
+    if args.save:
+        if not comparable:
+            # The sizes already in it were run with other searches, don't mix them in
+            baseline = dict()
+        baseline.setdefault('sizes', dict()).update(runs)
+        baseline.update(python=platform.python_version(), machine=platform.platform(), searches=args.searches, seed=args.seed)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.baseline}")
+
+    if worse:
+        print(f"{len(worse)} regressions against {args.baseline}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
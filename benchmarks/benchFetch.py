@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pageFetcher
+from fakeServices import FakeBrowse, FakeServer
+
+# Measures catalogue download time against page count and page size using a local fake of /ajax/browse
+# e.g. python benchmarks/benchFetch.py --catalogue 30000 --page-sizes 1000 6000 --workers 1 4 8 --latency 0.2
+
+
+def run(catalogue, page_size, workers, latency, failure_rate):
+    browse = FakeBrowse(catalogue, latency=latency, failure_rate=failure_rate)
+    with FakeServer({'/ajax/browse': browse}) as server:
+        session = pageFetcher.pooled_session(pool_size=workers)
+        t = time.perf_counter()
+        hits = pageFetcher.fetch_all_pages(session, url=server.base_url + '/ajax/browse', page_size=page_size, max_workers=workers)
+        elapsed = time.perf_counter() - t
+    pages = -(-catalogue // page_size)
+    assert hits is not None and len(hits) == catalogue, f"expected {catalogue} unique hits, got {len(hits) if hits else None}"
+    return pages, browse.requests, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalogue', type=int, default=24000)
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[1000, 3000, 6000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds of simulated network latency per request')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    args = parser.parse_args()
+
+    print(f"{'page size':>10} {'pages':>6} {'workers':>8} {'requests':>9} {'seconds':>8}")
+    for page_size in args.page_sizes:
+        for workers in args.workers:
+            pages, requests_made, elapsed = run(args.catalogue, page_size, workers, args.latency, args.failure_rate)
+            print(f"{page_size:>10} {pages:>6} {workers:>8} {requests_made:>9} {elapsed:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+from boto3.dynamodb.types import TypeDeserializer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import productListing
+
+# Turning scanned items into listings for the search index: the resource's TypeDeserializer (a Decimal per number) plus
+# a dict backed listing like the search function used to have, against listing_from_wire into the slots listing.
+# Reports items/sec and the memory each listing keeps (tracemalloc) once built
+# e.g. python benchmarks/benchListings.py --sizes 1000 10000 50000
+
+
+class DictListing:
+    # The old search function listing, attributes in a __dict__
+    def __init__(self, name, price, drink_type, count, volume, alcPerc, category, rating, sku, value, adjValue, sale, image):
+        self.name = name
+        self.price = price
+        self.type = drink_type.lower() if drink_type is not None else None
+        self.count = count
+        self.volume = volume
+        self.alcPerc = alcPerc
+        self.category = category.lower() if category is not None else None
+        self.rating = rating
+        self.sku = sku
+        self.value = value
+        self.adjValue = adjValue
+        self.sale = sale
+        self.image = image
+        self.inventory = dict()
+
+
+def make_wire_items(size, seed=0):
+    # Items the way a low-level scan returns them
+    rng = random.Random(seed)
+    items = []
+    for i in range(size):
+        image = {'S': f"https://www.bcliquorstores.com/files/images/{100000 + i}.jpg"} if rng.random() > 0.1 else {'NULL': True}
+        items.append({
+            'sku': {'N': str(100000 + i)},
+            'name': {'S': f"Product {i}"},
+            'type': {'S': rng.choice(['beer', 'wine', 'spirits'])},
+            'category': {'S': rng.choice(['lager', 'ipa', 'red wine', 'vodka'])},
+            'price': {'N': str(round(rng.uniform(2, 100), 2))},
+            'count': {'N': str(rng.choice([1, 6, 12]))},
+            'volume': {'N': rng.choice(['0.355', '0.75', '1.14'])},
+            'alcPerc': {'N': str(round(rng.uniform(4, 45), 1))},
+            'rating': {'N': str(round(rng.uniform(1, 5), 1))},
+            'value': {'N': str(round(rng.uniform(1.2, 6), 1))},
+            'adjValue': {'N': str(round(rng.uniform(0, 100), 1))},
+            'sale': {'N': str(rng.choice([0, round(rng.uniform(5, 30), 6)]))},
+            'image': image,
+            'image_ok': {'BOOL': 'S' in image},
+            'inventory': {'M': {store: {'S': str(rng.choice([0, 3, 12]))} for store in ('218', '178', '82', '161')}},
+        })
+    return items
+
+
+def resource_listings(items):
+    deserializer = TypeDeserializer()
+    listings = []
+    for raw in items:
+        elem = {key: deserializer.deserialize(value) for key, value in raw.items()}
+        listing = DictListing(name=elem['name'], price=float(elem['price']), drink_type=elem['type'], count=int(elem['count']),
+                              volume=float(elem['volume']), alcPerc=elem['alcPerc'], category=elem['category'], rating=float(elem['rating']),
+                              sku=elem['sku'], value=elem['value'], adjValue=float(elem['adjValue']), sale=float(elem['sale']), image=elem['image'])
+        listing.inventory = {k: int(v) for k, v in elem['inventory'].items()}
+        listing.image_ok = elem.get('image_ok', elem['image'] is not None)
+        listings.append(listing)
+    return listings
+
+
+def wire_listings(items):
+    return [productListing.listing_from_wire(item) for item in items]
+
+
+def measure(fn, items):
+    gc.collect()
+    t = time.perf_counter()
+    fn(items)
+    elapsed = time.perf_counter() - t
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    listings = fn(items)
+    kept = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del listings
+    return len(items) / elapsed, kept / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    args = parser.parse_args()
+
+    print(f"{'items':>7} {'resource items/s':>17} {'wire items/s':>13} {'speedup':>8} {'resource B/listing':>19} {'wire B/listing':>15}")
+    for size in args.sizes:
+        items = make_wire_items(size)
+        old_rate, old_bytes = measure(resource_listings, items)
+        new_rate, new_bytes = measure(wire_listings, items)
+        print(f"{size:>7} {old_rate:>17.0f} {new_rate:>13.0f} {new_rate / old_rate:>7.1f}x {old_bytes:>19.0f} {new_bytes:>15.0f}")
+
+
+if __name__ == '__main__':
+    main()
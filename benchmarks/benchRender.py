@@ -0,0 +1,91 @@
+import argparse
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtureEnv
+fixtureEnv.apply()
+
+import dbSearch
+import productListing
+
+# Renders N result cards the old way (deepcopy + str.replace chain) and with the compiled templates, checks they match
+# e.g. python benchmarks/benchRender.py --cards 5 50 500
+
+
+def make_listings(count):
+    listings = []
+    for i in range(count):
+        listing = productListing.Listing(name=f"Product {i}", price=12.99 + i % 40, drink_type='beer', count=6 if i % 2 else 1, volume=0.355 if i % 3 else 1.14,
+                                         alcPerc=5.5, category='lager', rating=3.7, sku=100000 + i, value=2.4, adjValue=71.3, sale=i % 15, image=None)
+        listing.inventory = {'218': 12, '82': 3, '140': 40}
+        listings.append(listing)
+    return listings
+
+
+def render_old(listings):
+    blocks = []
+    for listing in listings:
+        card = copy.deepcopy(dbSearch.template('MODAL_DRINK_CARD_TEMPLATE'))
+        location = copy.deepcopy(dbSearch.template('MODAL_LOCATION_CARD_TEMPLATE'))
+        fields = dbSearch.card_fields(listing, False)
+        card['text']['text'] = card['text']['text'] \
+            .replace('{liquor_link}', fields['liquor_link']) \
+            .replace('{drink_name}', fields['drink_name']) \
+            .replace('{volume}', fields['volume']) \
+            .replace('{alcPerc}', fields['alcPerc']) \
+            .replace('{score}', fields['score']) \
+            .replace('{price}', fields['price']) \
+            .replace('{value}', fields['value']) \
+            .replace('{rating}', fields['rating']) \
+            .replace('{sale}', fields['sale'])
+        card['accessory']['image_url'] = fields['image_url']
+        stores_string = ""
+        for store, stock in listing.inventory.items():
+            stores_string += ("{}({} in stock)\n".format(dbSearch.template('STORE_NAME_MAP')[store], stock))
+        location['elements'][1]['text'] = location['elements'][1]['text'].replace('{locations}', stores_string)
+        blocks += [card, location, dbSearch.template('DIVIDER_TEMPLATE')]
+    return blocks
+
+
+def render_compiled(listings):
+    blocks = []
+    for listing in listings:
+        blocks.append(dbSearch.renderer('MODAL_DRINK_CARD_TEMPLATE')(dbSearch.card_fields(listing, False)))
+        blocks.append(dbSearch.renderer('MODAL_LOCATION_CARD_TEMPLATE')({'locations': dbSearch.location_text(listing)}))
+        blocks.append(dbSearch.template('DIVIDER_TEMPLATE'))
+    return blocks
+
+
+def best_of(fn, listings, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn(listings)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cards', type=int, nargs='+', default=[5, 50, 500])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    # card_fields prints for missing images, keep the output readable
+    dbSearch.print = lambda *a, **k: None
+
+    print(f"{'cards':>6} {'old ms':>9} {'compiled ms':>12} {'speedup':>8}")
+    for count in args.cards:
+        listings = make_listings(count)
+        assert render_old(listings) == render_compiled(listings)
+        old = best_of(render_old, listings, args.repeat)
+        new = best_of(render_compiled, listings, args.repeat)
+        print(f"{count:>6} {old * 1000:>9.3f} {new * 1000:>12.3f} {old / new:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
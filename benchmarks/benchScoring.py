@@ -0,0 +1,64 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scoring
+
+# Re-ranks a whole catalogue with custom weights, per-item python loop against the numpy columns + argpartition
+# e.g. python benchmarks/benchScoring.py --sizes 1000 10000 50000 --top 5
+
+
+def make_columns(size, seed=0):
+    rng = random.Random(seed)
+    values = [round(rng.uniform(1.2, 6), 1) for _ in range(size)]
+    ratings = [round(rng.uniform(1, 5), 1) for _ in range(size)]
+    sales = [rng.choice([0, 0, 0, rng.uniform(5, 30)]) for _ in range(size)]
+    return values, ratings, sales
+
+
+def rank_loop(values, ratings, sales, weights, n):
+    scored = [(scoring.adj_value(values[i], ratings[i], sales[i], weights), i) for i in range(len(values))]
+    scored.sort(reverse=True)
+    return [i for score, i in scored[:n]]
+
+
+def rank_vectorised(values, ratings, sales, weights, n):
+    return scoring.top_n(scoring.scores(values, ratings, sales, weights), n)
+
+
+def best_of(fn, args, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - t)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    weights = dict(value=0.5, rating=0.4, sale=0.6)
+
+    print(f"{'items':>7} {'loop ms':>9} {'numpy ms':>9} {'speedup':>8}")
+    for size in args.sizes:
+        values, ratings, sales = make_columns(size)
+        columns = [np.array(values), np.array(ratings), np.array(sales)]
+        loop, expected = best_of(rank_loop, (values, ratings, sales, weights, args.top), args.repeat)
+        vectorised, result = best_of(rank_vectorised, (*columns, weights, args.top), args.repeat)
+        loop_scores = [scoring.adj_value(values[i], ratings[i], sales[i], weights) for i in expected]
+        assert np.allclose(loop_scores, scoring.scores(*columns, weights)[result])
+        print(f"{size:>7} {loop * 1000:>9.3f} {vectorised * 1000:>9.3f} {loop / vectorised:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
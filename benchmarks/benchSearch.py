@@ -0,0 +1,69 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtureEnv
+fixtureEnv.apply()
+
+import dbSearch
+import productListing
+import searchIndex
+from fakeServices import make_catalogue
+
+# Time to match a search term over the whole catalogue, old type/category substring match against the word index.
+# Cold is the first time a container sees the term (postings turned into bitsets), warm is a repeat
+# e.g. python benchmarks/benchSearch.py --size 20000 --queries beer "ipa tallboy" vodak
+
+QUERIES = ['beer', 'vodka', 'vodak', 'red wine', 'ipa tallboy', 'hazy', 'whiskey', 'lagr']
+
+
+def make_listings(size, seed=0):
+    rng = random.Random(seed)
+    listings = []
+    for hit in make_catalogue(size, seed):
+        source = hit['_source']
+        listing = productListing.Listing(name=source['name'], price=rng.uniform(2, 100), drink_type=source['productType'], count=1, volume=0.75,
+                                         alcPerc=5.0, category=source['productCategory'], rating=3.0, sku=source['sku'], value=2.0,
+                                         adjValue=rng.uniform(0, 100), sale=0.0, image=None)
+        listing.inventory = {'218': rng.choice([0, 5])}
+        listings.append(listing)
+    return listings
+
+
+def time_term(index, term, cold):
+    if cold:
+        index.term_cache.clear()
+        index.word_bits.clear()
+    t = time.perf_counter()
+    mask = index.term_bits(term)
+    return time.perf_counter() - t, bin(mask).count('1')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=20000)
+    parser.add_argument('--queries', nargs='+', default=QUERIES)
+    args = parser.parse_args()
+
+    listings = make_listings(args.size)
+    t = time.perf_counter()
+    blob = searchIndex.build_index((listing.sku, [listing.name, listing.type, listing.category]) for listing in listings)
+    print(f"Built word index of {len(blob['terms'])} terms over {args.size} products in {time.perf_counter() - t:.3f}s")
+    substring = dbSearch.ProductIndex(listings, None)
+    words = dbSearch.ProductIndex(listings, None, searchIndex.SearchIndex(blob))
+
+    print(f"{'query':>14} {'old hits':>9} {'old ms':>8} {'hits':>6} {'cold ms':>8} {'warm ms':>8}")
+    for query in args.queries:
+        old, old_hits = time_term(substring, query, cold=True)
+        cold, hits = time_term(words, query, cold=True)
+        words.term_cache.clear()
+        warm, hits = time_term(words, query, cold=False)
+        print(f"{query:>14} {old_hits:>9} {old * 1000:>8.3f} {hits:>6} {cold * 1000:>8.3f} {warm * 1000:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtureEnv
+from fakeServices import FakeBrowse, FakeInventory, FakeServer
+
+# Refreshes a catalogue in one invocation and split between worker invocations, run in process through
+# cache.invoke_locally, against the fake site and moto. Fails unless the sharded runs end up with the same refresh state
+# and totals as the unsharded one, and a shard that fails leaves its skus for the next run. Each shard checks stock at
+# INVENTORY_RATE, so with the default rate the unsharded run takes about 30 seconds
+# e.g. python benchmarks/benchShards.py --listings 3000 --shards 2 4 --inventory-latency 0.02
+
+fixtureEnv.apply()
+
+from moto import mock_aws
+
+
+def refresh(cache, shards, invoke):
+    # One cold refresh on empty tables. Returns the summary, the state it saved, the number of items stored and seconds
+    import metaStore
+    from benchWrites import create_tables
+    with mock_aws():
+        create_tables()
+        cache.table = None
+        metaStore.table = None
+        cache.REFRESH_SHARDS = shards
+        t = time.perf_counter()
+        summary = cache.update_product_cache(time.monotonic() + 600, invoke if shards > 1 else None)
+        elapsed = time.perf_counter() - t
+        state = metaStore.load_blob(cache.REFRESH_STATE)
+        stored = cache.get_table().scan(Select='COUNT')['Count']
+    return summary, state, stored, elapsed
+
+
+def failing_first_shard(cache):
+    # Like invoke_locally but the first shard's worker dies. Returns the invoke and the skus that shard had
+    lost = set()
+
+    def invoke(payload):
+        if not lost:
+            lost.update(listing['sku'] for listing in payload['listings'])
+            raise RuntimeError("worker timed out")
+        return cache.invoke_locally(payload)
+    return invoke, lost
+
+
+def check(name, summary, state, stored, expected, lost=()):
+    # expected is the unsharded run's summary and state
+    live = {sku: entry for sku, entry in expected[1].items() if int(sku) not in lost}
+    assert summary['failed_shards'] == (1 if lost else 0), f"{name}: {summary['failed_shards']} shards failed"
+    assert summary['refreshed'] == expected[0]['refreshed'] - len(lost), f"{name}: refreshed {summary['refreshed']}"
+    assert summary['remaining'] == len(lost), f"{name}: {summary['remaining']} remaining, expected {len(lost)}"
+    assert summary['written'] + summary['skipped'] == summary['refreshed'], f"{name}: written and skipped don't add up to refreshed"
+    assert stored == summary['written'], f"{name}: {stored} items in the table, {summary['written']} written"
+    assert set(state) == set(live), f"{name}: state has {len(state)} skus, expected {len(live)}"
+    # Fingerprints of what was written and of the browse listing, the times differ between runs
+    mismatched = [sku for sku, entry in state.items() if (entry[1], entry[3]) != (live[sku][1], live[sku][3])]
+    assert not mismatched, f"{name}: {len(mismatched)} skus have different state, e.g. {mismatched[:3]}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=1000, help='skus in the fake catalogue, some are filtered out')
+    parser.add_argument('--shards', type=int, nargs='+', default=[2, 3, 5])
+    parser.add_argument('--inventory-latency', type=float, default=0.005, help='seconds the fake site takes per stock request')
+    args = parser.parse_args()
+
+    inventory = FakeInventory(latency=args.inventory_latency)
+    with FakeServer({'/ajax/browse': FakeBrowse(args.listings), '/ajax/get-product-inventory': inventory}) as server:
+        import cache
+        import imageCache
+        import inventoryRefresher
+        cache.url = server.base_url + '/ajax/browse'
+        inventoryRefresher.INVENTORY_URL = server.base_url + '/ajax/get-product-inventory?sku='
+        imageCache.image_exists = lambda session, image: True
+
+        print(f"{'shards':>12} {'refreshed':>10} {'written':>8} {'remaining':>10} {'failed shards':>14} {'seconds':>8}")
+        expected = None
+        for shards in [1] + args.shards:
+            summary, state, stored, elapsed = refresh(cache, shards, cache.invoke_locally)
+            print(f"{shards:>12} {summary['refreshed']:>10} {summary['written']:>8} {summary['remaining']:>10} "
+                  f"{summary.get('failed_shards', 0):>14} {elapsed:>8.2f}")
+            if expected is None:
+                assert summary['refreshed'] > 0 and summary['remaining'] == 0, f"unsharded run didn't finish: {summary}"
+                expected = (summary, state)
+                continue
+            assert summary['shards'] == min(shards, summary['refreshed']), f"{shards} shards: ran {summary['shards']}"
+            check(f"{shards} shards", summary, state, stored, expected)
+
+        shards = max(args.shards)
+        invoke, lost = failing_first_shard(cache)
+        summary, state, stored, elapsed = refresh(cache, shards, invoke)
+        print(f"{f'{shards}, 1 lost':>12} {summary['refreshed']:>10} {summary['written']:>8} {summary['remaining']:>10} "
+              f"{summary['failed_shards']:>14} {elapsed:>8.2f}")
+        check(f"{shards} shards with one lost", summary, state, stored, expected, lost)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+from urllib.parse import urlencode
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtureEnv
+import metrics
+from fakeServices import FakeServer, FakeSlack
+
+# Time from Slack's request to our response for each kind of event, against a fake Slack API and a stubbed Lambda
+# invoke. Slack drops the request after 3 seconds. "bare" posts to Slack without the shared session, the way it used to
+# e.g. python benchmarks/benchSlackHandler.py --runs 200 --slack-latency 0.05 --invoke-latency 0.03
+
+DEADLINE_MS = 3000
+
+
+class StubLambda:
+    # Stands in for the boto3 lambda client, an Event invoke only waits for Lambda to queue the payload
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        if self.latency:
+            time.sleep(self.latency)
+        self.payloads.append(json.loads(Payload))
+        return {'StatusCode': 202}
+
+
+class BareSlack:
+    # A new connection for every call
+    def post(self, url, **kwargs):
+        return requests.post(url, **kwargs)
+
+
+def interactivity_event(payload):
+    # How API Gateway hands us Slack's form encoded interactivity posts
+    body = urlencode({'payload': json.dumps(payload)})
+    return {'body': base64.b64encode(body.encode('utf-8')).decode('ascii'), 'isBase64Encoded': True}
+
+
+def make_events():
+    values = {
+        'search': {'query': {'type': 'plain_text_input', 'value': 'ipa tallboy'}},
+        'stores': {'selected_stores': {'type': 'multi_static_select', 'selected_options': [{'value': '218'}, {'value': '82'}]}},
+        'max_price': {'max_price': {'type': 'plain_text_input', 'value': '30'}},
+        'value_weight': {'value_weight': {'type': 'plain_text_input', 'value': '0.5'}},
+    }
+    return {
+        'shortcut': interactivity_event({'type': 'shortcut', 'trigger_id': '1.2.3'}),
+        'block_actions': interactivity_event({'type': 'block_actions', 'trigger_id': '1.2.3', 'actions': [{'value': 'find_liquor'}]}),
+        'app_home_opened': {'body': json.dumps({'type': 'event_callback', 'event': {'type': 'app_home_opened', 'user': 'U123'}}), 'isBase64Encoded': False},
+        'view_submission': interactivity_event({'type': 'view_submission', 'trigger_id': '1.2.3', 'view': {'state': {'values': values}},
+                                                'response_urls': [{'response_url': 'https://hooks.slack.com/app/fake'}]}),
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(slackHandler, events, runs):
+    # Phase times come from the metrics record each invocation emits
+    records = []
+    old_sink = metrics.set_sink(records.append)
+    results = dict()
+    try:
+        for name, event in events.items():
+            totals, phases = [], dict()
+            for _ in range(runs):
+                t = time.perf_counter()
+                response = slackHandler.lambda_handler(event, None)
+                totals.append((time.perf_counter() - t) * 1000)
+                assert response['statusCode'] == 200, response
+                for key, value in records.pop().items():
+                    if key.endswith('_ms') and key != 'total_ms':
+                        phases.setdefault(key[:-len('_ms')], []).append(value)
+            results[name] = (totals, {phase: statistics.mean(ms) for phase, ms in phases.items()})
+    finally:
+        metrics.set_sink(old_sink)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--slack-latency', type=float, default=0.0, help='seconds the fake Slack API takes to answer')
+    parser.add_argument('--invoke-latency', type=float, default=0.0, help='seconds the stubbed Lambda invoke takes')
+    args = parser.parse_args()
+
+    slack_api = FakeSlack(args.slack_latency)
+    with FakeServer({'/api/': slack_api}) as server:
+        os.environ['SLACK_API_BASE'] = server.base_url + '/api/'
+        fixtureEnv.apply()
+        import slackHandler
+        slackHandler.lambda_client = StubLambda(args.invoke_latency)
+        session = slackHandler.get_slack()
+        events = make_events()
+
+        print(f"{'event':>16} {'mode':>8} {'p50 ms':>8} {'p99 ms':>8} {'headroom':>9}  phases (mean ms)")
+        for mode, client in (('session', session), ('bare', BareSlack())):
+            slackHandler.slack = client
+            for name, (totals, phases) in run(slackHandler, events, args.runs).items():
+                p99 = percentile(totals, 0.99)
+                breakdown = ' '.join(f"{phase}={ms:.2f}" for phase, ms in phases.items())
+                print(f"{name:>16} {mode:>8} {percentile(totals, 0.5):>8.2f} {p99:>8.2f} {DEADLINE_MS - p99:>8.0f}ms  {breakdown}")
+        print(f"Slack API calls: {slack_api.calls}, searches invoked: {len(slackHandler.lambda_client.payloads)}")
+
+
+if __name__ == '__main__':
+    main()
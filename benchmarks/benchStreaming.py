@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fixtureEnv
+fixtureEnv.apply()
+
+import cache
+import pageFetcher
+from fakeServices import FakeBrowse, FakeServer
+
+# Peak memory of turning the browse pages into listings, whole pages with res.json() against the streaming parser
+# e.g. python benchmarks/benchStreaming.py --catalogue 30000 --page-size 6000
+
+
+def materialised(session, browse_url, page_size):
+    hits = pageFetcher.fetch_all_pages(session, url=browse_url, page_size=page_size)
+    return {listing.sku: listing for listing in cache.iter_listings(hits)}
+
+
+def streaming(session, browse_url, page_size):
+    return {listing.sku: listing for listing in cache.iter_listings(pageFetcher.stream_all_hits(session, url=browse_url, page_size=page_size))}
+
+
+def measure(fn, session, browse_url, page_size):
+    tracemalloc.start()
+    t = time.perf_counter()
+    listings = fn(session, browse_url, page_size)
+    elapsed = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(listings), peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--catalogue', type=int, default=30000)
+    parser.add_argument('--page-size', type=int, default=6000)
+    parser.add_argument('--workers', type=int, default=pageFetcher.MAX_FETCH_WORKERS)
+    args = parser.parse_args()
+
+    browse = FakeBrowse(args.catalogue)
+    with FakeServer({'/ajax/browse': browse}) as server:
+        browse_url = server.base_url + '/ajax/browse'
+        session = pageFetcher.pooled_session(pool_size=args.workers)
+        # Build the fake's pages up front so they don't count towards the peak
+        pageFetcher.fetch_all_pages(session, url=browse_url, page_size=args.page_size)
+
+        print(f"{'mode':>13} {'listings':>9} {'peak MB':>8} {'seconds':>8}")
+        for name, fn in (('materialised', materialised), ('streaming', streaming)):
+            count, peak, elapsed = measure(fn, session, browse_url, args.page_size)
+            print(f"{name:>13} {count:>9} {peak / 2**20:>8.1f} {elapsed:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
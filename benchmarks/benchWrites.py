@@ -0,0 +1,111 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runs the refresh write stage against moto's DynamoDB: a cold write, an unchanged rewrite and a partly changed one,
+# with some batches coming back as UnprocessedItems. Fails if any run writes or skips the wrong listings or gives up on any
+# e.g. python benchmarks/benchWrites.py --listings 5000 --changed 0.1 --unprocessed 0.2
+
+import fixtureEnv
+fixtureEnv.apply()
+
+from moto import mock_aws
+
+
+class FlakyClient:
+    # Hands back a fraction of every first attempt as UnprocessedItems, like a throttled table would
+    def __init__(self, client, rate, seed=0):
+        self.client = client
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.held_back = set()  # ids of requests already handed back once, BatchWriter keeps them alive until they're retried
+
+    def batch_write_item(self, RequestItems):
+        (name, requests), = RequestItems.items()
+        unprocessed = [r for r in requests if id(r) not in self.held_back and self.rng.random() < self.rate]
+        processed = [r for r in requests if r not in unprocessed]
+        self.held_back.difference_update(id(r) for r in processed)
+        self.held_back.update(id(r) for r in unprocessed)
+        if processed:
+            self.client.batch_write_item(RequestItems={name: processed})
+        return {'UnprocessedItems': {name: unprocessed} if unprocessed else {}}
+
+
+class FlakyTable:
+    def __init__(self, table, rate):
+        self.name = table.name
+        self.meta = type('Meta', (), {'client': FlakyClient(table.meta.client, rate)})
+
+
+def create_tables():
+    import boto3
+    ddb = boto3.resource('dynamodb')
+    ddb.create_table(TableName=os.environ['PRODUCT_TABLE'], KeySchema=[{'AttributeName': 'sku', 'KeyType': 'HASH'}],
+                     AttributeDefinitions=[{'AttributeName': 'sku', 'AttributeType': 'N'}], BillingMode='PAY_PER_REQUEST')
+    ddb.create_table(TableName=os.environ['META_TABLE'], KeySchema=[{'AttributeName': 'name', 'KeyType': 'HASH'}],
+                     AttributeDefinitions=[{'AttributeName': 'name', 'AttributeType': 'S'}], BillingMode='PAY_PER_REQUEST')
+
+
+def make_results(cache, count, seed=0):
+    rng = random.Random(seed)
+    results = []
+    for i in range(count):
+        listing = cache.Listing(name=f"Product {i}", price=round(rng.uniform(2, 100), 2), drink_type='Beer', count=6, volume=0.355,
+                                alcPerc=5.0, category='Lager', rating=3.5, sku=100000 + i, value=2.1, adjValue=round(rng.uniform(0, 100), 1),
+                                sale=0.0, image=None)
+        inventory = {str(store): str(rng.choice([0, 3, 12])) for store in (218, 178, 82)}
+        results.append((listing, inventory))
+    return results
+
+
+def run(cache, table, results, state):
+    import dbUtils
+    t = time.perf_counter()
+    with dbUtils.BatchWriter(table) as writer:
+        cache.write_listings(writer, results, state)
+    return writer.stats, time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=2000)
+    parser.add_argument('--changed', type=float, default=0.1, help='fraction of listings whose stock changes between runs')
+    parser.add_argument('--unprocessed', type=float, default=0.1, help='fraction of each first batch attempt left unprocessed')
+    args = parser.parse_args()
+
+    with mock_aws():
+        create_tables()
+        import cache
+        import dbUtils
+        dbUtils.BATCH_BACKOFF = 0.01
+        table = FlakyTable(cache.get_table(), args.unprocessed)
+
+        results = make_results(cache, args.listings)
+        changed = int(len(results) * args.changed)
+        # Listings each run should write, the rest should be skipped
+        expected = {'cold': len(results), 'unchanged': 0, 'changed': changed}
+        state = dict()
+        print(f"{'run':>10} {'written':>8} {'skipped':>8} {'retried':>8} {'failed':>7} {'seconds':>8}")
+        for name in ('cold', 'unchanged', 'changed'):
+            if name == 'changed':
+                for listing, inventory in random.Random(1).sample(results, changed):
+                    inventory['218'] = str(int(inventory['218']) + 1)
+            stats, elapsed = run(cache, table, results, state)
+            print(f"{name:>10} {stats['written']:>8} {stats['skipped']:>8} {stats['retried']:>8} {stats['failed']:>7} {elapsed:>8.3f}")
+
+            assert stats['written'] == expected[name], f"{name}: expected {expected[name]} written, got {stats['written']}"
+            assert stats['skipped'] == len(results) - expected[name], f"{name}: expected {len(results) - expected[name]} skipped, got {stats['skipped']}"
+            assert stats['failed'] == 0, f"{name}: gave up on {stats['failed']} items"
+            if args.unprocessed and expected[name]:
+                assert stats['retried'] > 0, f"{name}: no unprocessed items were retried"
+
+        stored = cache.get_table().scan(Select='COUNT')['Count']
+        assert stored == args.listings, f"expected {args.listings} items in the table, found {stored}"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-ins for the remote services the lambdas talk to. Everything is generated from a seed so runs are repeatable
+
+PRODUCT_TYPES = [('Beer', 'Lager'), ('Beer', 'Ale'), ('Beer', 'IPA'), ('Spirits', 'Vodka'), ('Spirits', 'Gin'),
+                 ('Spirits', 'Whisky'), ('Wine', 'Red Wine'), ('Wine', 'White Wine'), ('Refreshment', 'Cider')]
+NAME_WORDS = ['Island', 'Coast', 'Hazy', 'Golden', 'Black', 'Harbour', 'Pacific', 'Tallboy', 'Reserve', 'Craft', 'Northern', 'Dry']
+
+
+def make_catalogue(size, seed=0):
+    rng = random.Random(seed)
+    hits = []
+    for i in range(size):
+        drink_type, category = rng.choice(PRODUCT_TYPES)
+        units = rng.choice([1, 1, 1, 6, 12, 24])
+        regular = round(rng.uniform(2, 120), 2)
+        current = regular if rng.random() > 0.2 else round(regular * rng.uniform(0.7, 0.95), 2)
+        hits.append({'_source': {
+            'sku': 100000 + i,
+            'name': ' '.join(rng.sample(NAME_WORDS, 2)) + ' ' + category,
+            'currentPrice': str(current) if rng.random() > 0.01 else None,
+            'regularPrice': str(regular),
+            'unitSize': units,
+            'volume': str(rng.choice([0.355, 0.473, 0.75, 1.14])),
+            'alcoholPercentage': str(round(rng.uniform(4, 45), 1)),
+            'image': f"http://www.bcliquorstores.com/files/images/{100000 + i}.jpeg" if rng.random() > 0.1 else None,
+            'consumerRating': round(rng.uniform(1, 5), 1) if rng.random() > 0.3 else None,
+            'productType': drink_type,
+            'productCategory': category,
+            'availableUnits': rng.choice([0, 5, 50, 500]),
+        }})
+    return hits
+
+
+class FakeBrowse:
+    # Serves /ajax/browse the way BC Liquor does: total_pages on every page and a last page padded with repeats up to page size
+    def __init__(self, size, seed=0, latency=0.0, failure_rate=0.0):
+        self.catalogue = make_catalogue(size, seed)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.pages = {}
+
+    def page_body(self, page, page_size):
+        key = (page, page_size)
+        if key not in self.pages:
+            total = len(self.catalogue)
+            total_pages = max(1, -(-total // page_size))
+            hits = self.catalogue[(page - 1) * page_size:page * page_size]
+            if page == total_pages and total_pages > 1:
+                hits = self.catalogue[total - page_size:total]
+            self.pages[key] = json.dumps({'hits': {'total': total, 'total_pages': total_pages, 'hits': hits}}).encode()
+        return self.pages[key]
+
+    def handle(self, handler, parsed):
+        query = parse_qs(parsed.query)
+        page = int(query.get('page', ['1'])[0])
+        page_size = int(query.get('size', ['6000'])[0])
+        return 200, self.page_body(page, page_size)
+
+    def respond(self, handler, parsed):
+        with self.lock:
+            self.requests += 1
+            fail = self.rng.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            return 503, b'{"error": "unavailable"}'
+        return self.handle(handler, parsed)
+
+
+class FakeInventory(FakeBrowse):
+    # Serves /ajax/get-product-inventory?sku=. Answers 429 when asked more than max_rate times in a second
+    def __init__(self, stores=('218', '178', '82', '161', '140', '150', '242', '124', '181'), seed=0, latency=0.0, failure_rate=0.0, max_rate=None):
+        self.stores = stores
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_rate = max_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.throttled = 0
+        self.window = []
+        self.lock = threading.Lock()
+
+    def handle(self, handler, parsed):
+        if self.max_rate is not None:
+            with self.lock:
+                now = time.monotonic()
+                self.window = [t for t in self.window if now - t < 1] + [now]
+                if len(self.window) > self.max_rate:
+                    self.throttled += 1
+                    return 429, b'{}'
+        sku = int(parse_qs(parsed.query)['sku'][0])
+        rng = random.Random(sku)
+        stock = [{'storeNumber': int(store), 'inventory': {'available': rng.choice([0, 0, 3, 12, 40])}} for store in self.stores if rng.random() > 0.3]
+        return 200, json.dumps(stock).encode()
+
+
+class FakeSlack:
+    # Slack's Web API (views.open, views.publish...) and the response_url hooks search results are posted to. Every call
+    # is answered with ok after latency seconds and counted by method or hook name, along with the bytes posted
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = dict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def respond(self, handler, parsed):
+        with self.lock:
+            name = parsed.path.rsplit('/', 1)[-1]
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.bytes += len(getattr(handler, 'request_body', b''))
+        if self.latency:
+            time.sleep(self.latency)
+        return 200, b'{"ok": true}'
+
+
+class FakeServer:
+    # Routes path prefixes to fake services on a threaded localhost server
+    def __init__(self, routes):
+        self.routes = routes
+        routes_ref = routes
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out as separate writes, with Nagle on a kept-alive connection waits out the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def dispatch(self):
+                parsed = urlparse(self.path)
+                for prefix, service in routes_ref.items():
+                    if parsed.path.startswith(prefix):
+                        status, body = service.respond(self, parsed)
+                        break
+                else:
+                    status, body = 404, b'{}'
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = dispatch
+            do_HEAD = dispatch
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self.request_body = self.rfile.read(length)
+                self.dispatch()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,30 @@
+import os
+
+# Env vars for running the lambdas locally, templates copied from the README
+
+FIXTURE_ENV = {
+    'AWS_DEFAULT_REGION': 'us-west-2',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'PRODUCT_TABLE': 'products',
+    'META_TABLE': 'meta',
+    'IMAGE_BASE800': 'https://www.bcliquorstores.com/files/images/',
+    'BOT_TOKEN': 'xoxb-fixture',
+    'SEARCH_FUNCTION_ARN': 'arn:aws:lambda:us-west-2:123456789012:function:dbSearch',
+    'TOP_N_RESULTS': '5',
+    'DIVIDER_TEMPLATE': '{"type": "divider"}',
+    'MODAL_DRINK_CARD_TEMPLATE': '{"type": "section","text": {"type": "mrkdwn","text": "*<{liquor_link}|{drink_name}>*\\n_({volume})_ {alcPerc}%\\nScore: *{score}*/100\\n*_${price}_* (with tax){sale}\\nRaw Value: *{value}*\\n{rating}"},"accessory": {"type": "image","image_url": "{image_url}","alt_text": "alcohol, probably"}}',
+    'MODAL_LOCATION_CARD_TEMPLATE': '{"type": "context","elements": [{"type": "image","image_url": "https://api.slack.com/img/blocks/bkb_template_images/tripAgentLocationMarker.png","alt_text": "Location Pin Icon"},{"type": "plain_text","emoji": true,"text": "Location: {locations}"}]}',
+    'NOT_FOUND_IMAGE': 'https://netflixroulette.files.wordpress.com/2013/01/image-not-found.gif',
+    'PRODUCT_URL_BASE': 'http://www.bcliquorstores.com/product/',
+    'RETURN_MODAL_TEMPLATE': '{"text":"Search Complete!","blocks": [{"type": "section","text": {"type": "mrkdwn","text": "Here are the top *N* results"}}]}',
+    'RETURN_NO_RESULTS': '{"type":"context","elements": [{"type": "mrkdwn","text": "Sorry, there are no results that match your search :( Please try again with a modified search!"}]}',
+    'STORE_NAME_MAP': '{"218": "FORT","178":"FAIRFIELD","82":"HILLSIDE","161":"BLANSHARD","140":"CEDAR HILL","150":"JAMES BAY","242":"SAANICH","124":"GORGE & TILLICUM","181":"BROADMEAD"}',
+    'HOME_PAGE': '[{"type": "section","text": {"type": "mrkdwn","text": " "},"accessory": {"type": "button","text": {"type": "plain_text","text": "Find Liquor","emoji": true},"value": "find_liquor"}}]',
+    'MODAL': '{"type": "modal","title": {"type": "plain_text","text": "Liquor Bot","emoji": true},"submit": {"type": "plain_text","text": "Submit","emoji": true},"close": {"type": "plain_text","text": "Cancel","emoji": true},"blocks": [{"type": "input","block_id": "search","element": {"type": "plain_text_input","action_id": "query","placeholder": {"type": "plain_text","text": "all, beer, gin, vodka, etc"}},"label": {"type": "plain_text","text": "Search"}},{"type": "input","block_id": "stores","element": {"type": "multi_static_select","action_id": "selected_stores","options": [{"text": {"type": "plain_text","text": "FORT - Oak Bay high"},"value": "218"},{"text": {"type": "plain_text","text": "FAIRFIELD - Fairfield Plaza"},"value": "178"},{"text": {"type": "plain_text","text": "HILLSIDE - Hillside Mall"},"value": "82"}]},"label": {"type": "plain_text","text": "Stores","emoji": true}},{"type": "input","block_id": "max_price","element": {"type": "plain_text_input","action_id": "max_price","initial_value": "0"},"label": {"type": "plain_text","text": "Max Price (including tax)"}}]}',
+}
+
+
+def apply():
+    for key, value in FIXTURE_ENV.items():
+        os.environ.setdefault(key, value)
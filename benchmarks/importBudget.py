@@ -0,0 +1,72 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Import time of each Lambda entry point from python -X importtime, checked against a budget. A cold start pays this
+# before the handler runs, so anything heavy should be imported or created on first use instead of at module level.
+# Exits with 1 if any entry point is over budget
+# e.g. python benchmarks/importBudget.py --runs 7 --budget dbSearch=150
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.join(ROOT, 'benchmarks')
+BUDGETS_MS = {'slackHandler': 50, 'dbSearch': 200, 'cache': 200}
+
+
+def import_times(module):
+    # {module: (self us, cumulative us)} for the entry point and everything it imported, in one fresh interpreter
+    code = f"import sys; sys.path[:0] = [{ROOT!r}, {BENCHMARKS!r}]; import fixtureEnv; fixtureEnv.apply(); import {module}"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    # Lines come out children first, a top level line closes off everything listed since the last one
+    children = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times = (int(own), int(cumulative))
+        if name.startswith('  '):
+            children[name.strip()] = times
+        elif name.strip() == module:
+            children[module] = times
+            return children
+        else:
+            children = dict()
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per entry point, the median is reported')
+    parser.add_argument('--top', type=int, default=5, help='heaviest imports to list per entry point')
+    parser.add_argument('--budget', nargs='*', default=[], help='entry=ms overrides, e.g. dbSearch=150')
+    args = parser.parse_args()
+    budgets = dict(BUDGETS_MS, **{entry: int(ms) for entry, ms in (budget.split('=') for budget in args.budget)})
+
+    over = []
+    for module, budget in budgets.items():
+        import_times(module)  # Compiles anything without a .pyc so it isn't counted
+        runs = [import_times(module) for _ in range(args.runs)]
+        total = statistics.median(times[module][1] for times in runs) / 1000
+        status = 'ok' if total <= budget else 'OVER'
+        if total > budget:
+            over.append(module)
+        print(f"{module:<14} {total:>8.1f}ms  budget {budget}ms  {status}")
+
+        # Heaviest direct and indirect imports of the median run, excluding the entry point itself
+        times = sorted(runs, key=lambda times: times[module][1])[len(runs) // 2]
+        heaviest = sorted(((cumulative, name) for name, (own, cumulative) in times.items() if name != module), reverse=True)[:args.top]
+        for cumulative, name in heaviest:
+            print(f"    {name:<30} {cumulative / 1000:>8.1f}ms")
+        print(f"    {module + ' itself':<30} {times[module][0] / 1000:>8.1f}ms")
+
+    if over:
+        print(f"Over budget: {', '.join(over)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,44 @@
 import os
-import requests
-import boto3
 import json
 import time
-from datetime import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import decimal
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
-requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-import bs4
-import re
+import pageFetcher
+import imageCache
+import inventoryRefresher
+import metaStore
+import dbUtils
+import metrics
+import scoring
+import searchIndex
+from productListing import Listing
 
 PRODUCT_TABLE = os.environ['PRODUCT_TABLE']
 IMAGE_BASE800 = os.environ['IMAGE_BASE800']
 
-table = boto3.resource('dynamodb').Table(PRODUCT_TABLE)
+table = None  # Made on first use, see get_table
 
-inventoryUrl = "http://www.bcliquorstores.com/ajax/get-product-inventory?sku="
-url = "http://www.bcliquorstores.com/ajax/browse"
-pageSize = 6000
-params = dict(size=pageSize, page=1)
-valWeight = 0.9
-ratingWeight = 0.1
-saleWeight = 0.2
+def get_table():
+    global table
+    if table is None:
+        import boto3
+        table = boto3.resource('dynamodb').Table(PRODUCT_TABLE)
+    return table
 
-req = requests.Session()
-req.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:60.0) Gecko/20100101 Firefox/60.0'})
+# meta store blob of sku: [last time its inventory was refreshed, fingerprint of what we wrote, last time we wrote it, browse fingerprint]
+REFRESH_STATE = 'refresh_state'
+# Skus whose browse listing hasn't changed are only sent for a stock check once they're this stale. Keep it under CACHE_EXPIRY
+MAX_STALENESS = int(os.environ.get('MAX_STALENESS', 6*3600))
+BROWSE_FIELDS = ('currentPrice', 'regularPrice', 'availableUnits', 'consumerRating', 'image')
+CACHE_EXPIRY = 86400  # Listings that haven't been refreshed for this long are dropped from the cache
+# "scan" purges old listings with a scan every run, "ttl" stamps listings with expires_at and lets DynamoDB's TTL delete them
+EXPIRY_MODE = os.environ.get('EXPIRY_MODE', 'scan')
+# More than 1 splits the stock checks between that many worker invocations of this function
+REFRESH_SHARDS = int(os.environ.get('REFRESH_SHARDS', 1))
+url = pageFetcher.BROWSE_URL
+pageSize = pageFetcher.PAGE_SIZE
+
+req = pageFetcher.pooled_session(pool_size=max(pageFetcher.MAX_FETCH_WORKERS, imageCache.MAX_IMAGE_WORKERS, inventoryRefresher.MAX_INVENTORY_WORKERS), headers={'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:60.0) Gecko/20100101 Firefox/60.0'})
 
 
 # Helper class to convert a DynamoDB item to JSON.
@@ -37,74 +51,37 @@ class DecimalEncoder(json.JSONEncoder):
                 return int(o)
         return super(DecimalEncoder, self).default(o)
 
-class Listing:
-    def __init__(self, name, price, drink_type, count, volume, alcPerc, category, rating, sku, value, adjValue, sale, image):
-        self.name = name
-        self.price = price
-        self.type = drink_type.lower() if drink_type is not None else None
-        self.count = count
-        self.volume = volume
-        self.alcPerc = alcPerc
-        self.category = category.lower() if category is not None else None
-        self.rating = rating
-        self.sku = sku
-        self.value = value
-        self.adjValue = adjValue
-        self.sale = sale
-        self.image = image
-        
-        
-        # To later store inventory (store:stock)
-        self.inventory = dict()
-
-    def __eq__(self, other):
-        return other and self.sku == other.sku # Shouldn't be duplicate SKUs in BC liquor's stock
+def clear_old_cache():
+    if EXPIRY_MODE == 'ttl':
+        # DynamoDB deletes anything past expires_at by itself
+        return 0
 
-    def __hash__(self):
-        return hash((self.sku, self.name))
+    # Unchanged listings aren't rewritten so last_updated can be old for a listing we checked recently, keep those
+    state = metaStore.load_blob(REFRESH_STATE) or dict()
+    recently_checked = {sku for sku, entry in state.items() if entry[0] > time.time()-CACHE_EXPIRY}
 
-def clear_old_cache():
-    response = table.scan(
+    old_items = dbUtils.scan_items(get_table(),
         FilterExpression = 'last_updated < :24HoursAgo',
-        ExpressionAttributeValues = {":24HoursAgo": decimal.Decimal(time.time()-86400)},
+        ExpressionAttributeValues = {":24HoursAgo": decimal.Decimal(time.time()-CACHE_EXPIRY)},
         ProjectionExpression = 'sku, last_updated'
     )
-    to_remove = [i['sku'] for i in response['Items']]
-
-    for sku in to_remove:
-        table.delete_item(
-            Key = {'sku': sku}
-        )
+    with dbUtils.BatchWriter(get_table()) as writer:
+        for item in old_items:
+            if str(item['sku']) not in recently_checked:
+                writer.delete({'sku': item['sku']})
+    return writer.stats['written']
         
 # Fetches results in buckets of 6000 and merges before returning, filtering out prices that are too high and products out of stock
+# With STREAM_PAGES on (the default) hits are parsed as the pages download and turned into listings straight away,
+# so the raw page JSON is never held in memory all at once
+STREAM_PAGES = os.environ.get('STREAM_PAGES', '1') == '1'
 
-def fetchProducts():
-    res = req.get(url=url, params=params, timeout=10)
-    try:
-        data = res.json()
-        products = data['hits']['hits']
-        total_pages = data['hits']['total_pages']
-    except req.exceptions.Timeout as e:
-        print("BC Liquor site error: {}".format(e))
-        return
-
-    for i in range(2, total_pages+1):
-        params['page'] = i
-        res = req.get(url=url, params=params, timeout=10)
-
-        # Skip drinks missing prices or with 0 available units
-        data = [i for i in res.json() if i['_source']['currentPrice'] != None and i['_source']['availableUnits'] != 0]
-            
-        # The last page will contain n elements that have already come up so that (remaining unique elements + n = pageSize)
-        if i == total_pages:
-            unique_results = data['hits']['total'] % pageSize
-            products += data['hits']['hits'][unique_results:]
-        else:
-            products += data['hits']['hits']    
-
+def iter_listings(hits):
+    # Skip drinks missing prices or with 0 available units
+    for sku in hits:
+        if sku['_source']['currentPrice'] == None or sku['_source']['availableUnits'] == 0:
+            continue
 
-    listings = set()  # to append drinks to, avoiding duplicates
-    for sku in products:
         try:
             price = float(sku['_source']['currentPrice'])
             regPrice = float(sku['_source']['regularPrice'])
@@ -112,12 +89,12 @@ def fetchProducts():
             units = sku['_source']['unitSize']  # bottles/cans in product
             vol = float(sku['_source']['volume'])  # volume/unit
             alc = (float(sku['_source']['alcoholPercentage']))/100  # % alcohol
-            image = sku['_source']['image'].replace('jpeg', 'jpg') if sku['_source']['image'] is not None else None# Site lists them as jpeg but links actually require jpg
-            image = image.replace('http', 'https') # this is because a request to the http version will return a 301 instead of 200 or 404 like we want
+            image = sku['_source']['image']
             
         except:
             print(f"Error processing {sku['_source']['name']}")
-            
+            continue
+
         totalAlc = (units*vol)*(alc)
         value = (totalAlc/price)*100
         
@@ -127,28 +104,9 @@ def fetchProducts():
         
         if image is None:
             image = IMAGE_BASE800 + str(sku['_source']['sku']) + ".jpg"
-
-        # Check if remote image exists
-        if not requests.head(image, verify=False, timeout=2).ok:
-            # If remote image does not exist find a suitable replacement from the web
-            
-            print('Remote image does not exist for', sku['_source']['name'])
-            print('Finding suitable replacement from web')
-
-            search = sku['_source']['name']
-            formatted_search = search.replace(' ', '+')
-            img_url = 'https://www.bing.com/images/search?q=' + formatted_search
-
-            req_img = req.get(img_url)
-            soup = bs4.BeautifulSoup(req_img.content, 'html.parser')
-            img = soup.find('img', alt=re.compile('Image result for.*'))
-
-            if img is not None:
-                image = img['src']
-                print('Remote image found!', image)
-            else:
-                image = None
-                print('Remote image not found :(')  
+        else:
+            image = image.replace('jpeg', 'jpg') # Site lists them as jpeg but links actually require jpg
+            image = image.replace('http', 'https') # this is because a request to the http version will return a 301 instead of 200 or 404 like we want
         
         # Adjust value by considering the score from bc liquor's site
         if(sku['_source']['consumerRating'] == None):
@@ -156,112 +114,262 @@ def fetchProducts():
         else:
             rating = sku['_source']['consumerRating']
 
-        # 2 minute garbage algorithm to weight value and ratings. I'm not a math major
-        # Scale all values to 100 so weighting is even(?)
-        adjvalue = ((value*40)*valWeight) + ((rating*20)
-                                             * ratingWeight)+((sale*2)*saleWeight)
-
-        listings.add(Listing(name=sku['_source']['name'], 
-                            price=price, 
-                            drink_type=sku['_source']['productType'], 
-                            count=units, 
-                            volume=vol, 
-                            alcPerc=round(alc*100, 1), 
-                            category=sku['_source']['productCategory'], 
-                            rating=rating, 
-                            sku=sku['_source']['sku'], 
-                            value=round(value, 1), 
-                            adjValue=round(adjvalue, 1), 
-                            sale=sale, 
-                            image=image))
+        # Default ranking, searches with custom weights re-score from value, rating and sale
+        adjvalue = scoring.adj_value(value, rating, sale)
+
+        listing = Listing(name=sku['_source']['name'], 
+                    price=price, 
+                    drink_type=sku['_source']['productType'], 
+                    count=units, 
+                    volume=vol, 
+                    alcPerc=round(alc*100, 1), 
+                    category=sku['_source']['productCategory'], 
+                    rating=rating, 
+                    sku=sku['_source']['sku'], 
+                    value=round(value, 1), 
+                    adjValue=round(adjvalue, 1), 
+                    sale=sale, 
+                    image=image)
+        # Stock at BC Liquor overall moves with availableUnits, so an unchanged fingerprint means the stores' stock probably didn't change either
+        listing.browse_fp = dbUtils.fingerprint({field: sku['_source'].get(field) for field in BROWSE_FIELDS}, ignore=())
+        yield listing
+
+def fetchProducts():
+    # Streamed pages download while iter_listings consumes them, so the span covers the download in both modes
+    listings = dict()  # sku: listing, to avoid duplicates
+    with metrics.span('page_fetch'):
+        if STREAM_PAGES:
+            hits = pageFetcher.stream_all_hits(req, url=url, page_size=pageSize)
+        else:
+            hits = pageFetcher.fetch_all_pages(req, url=url, page_size=pageSize)
+            if hits is None:
+                print("BC Liquor site error, could not fetch the first page")
+                return
+
+        for listing in iter_listings(hits):
+            listings.setdefault(listing.sku, listing)
+    metrics.count('listings', len(listings))
+    if not listings:
+        print("BC Liquor site error, no products found")
+        return
+    listings = list(listings.values())
+
+    # Check images in bulk. Most come straight out of the cache, only new or expired ones hit the network
+    cached_images = imageCache.ImageCache.load()
+    images = imageCache.resolve_images(req, [(l.sku, l.name, l.image) for l in listings], cached_images)
+    for listing in listings:
+        listing.image = images[listing.sku]
+    cached_images.save()
 
     return listings
 
 # Create or update listings in the db
-def update_product_cache():
+def update_product_cache(deadline, invoke=None):
+    # invoke is set when the stock checks are fanned out to worker invocations, see refresh_shards
     listings = fetchProducts()
+    if listings is None:
+        return None
 
-    # Find the most recently updated items and drop them. Only update 600 entries each run
-    response = table.scan(
-        FilterExpression = 'last_updated < :2HoursAgo',
-        ExpressionAttributeValues = {":2HoursAgo": decimal.Decimal(time.time()-18000)},
-        ProjectionExpression = 'sku, last_updated'
-    )
-    skus_already_updated = [int(i['sku']) for i in response['Items']]
-    
-    for listing in [elem for elem in listings if elem.sku not in skus_already_updated][:600]:
-        inventory = dict()
-        # If we get an error wait a few seconds and try again
-        errors = 0
-        res = request_item_stock(listing.sku)
-        while res.status_code != 200 and errors < 3:
-            errors += 1
-            time.sleep(3)
-            res = request_item_stock(listing.sku)
-        if errors >= 3:
-            print("Too many errors from BC liquor. Stopping.")
-            return False
-
-        for store in res.json():
-            inventory[store['storeNumber']] = str(store['inventory']['available']) #Dynamodb wants this to be a string
-
-        response = table.update_item(
-            Key={'sku': decimal.Decimal(listing.sku)},
-            UpdateExpression="set #prod_name = :n, \
-                             price = :p, \
-                             #drink_type = :t, \
-                             #count_in_box = :c, \
-                             volume = :vol, \
-                             alcPerc = :a, \
-                             category = :cat, \
-                             rating = :r, \
-                             #cash_value = :v, \
-                             adjValue = :av, \
-                             sale = :s, \
-                             image = :i, \
-                             inventory = :in, \
-                             last_updated = :u",
-            ExpressionAttributeValues={
-                ':n': listing.name,
-                ':p': decimal.Decimal(str(listing.price)),
-                ':t': listing.type,
-                ':c': decimal.Decimal(str(listing.count)),
-                ':vol': decimal.Decimal(str(listing.volume)),
-                ':a': decimal.Decimal(str(listing.alcPerc)),
-                ':cat': listing.category,
-                ':r': decimal.Decimal(str(listing.rating)),
-                ':v': decimal.Decimal(str(listing.value)),
-                ':av': decimal.Decimal(str(listing.adjValue)),
-                ':s': decimal.Decimal(str(listing.sale)),
-                ':i': listing.image,
-                ':in': inventory,
-                ':u': decimal.Decimal(str(time.time()))
-            },
-            ExpressionAttributeNames={
-                '#prod_name': 'name',
-                '#drink_type': 'type',
-                '#count_in_box': 'count',
-                '#cash_value': 'value'
-            },
-            ReturnValues="UPDATED_NEW"
-        )
-
-        time.sleep(0.8)
-    return True
-
-def request_item_stock(sku):
-    res = req.get(url=inventoryUrl + str(sku))
-    return res
+    # Word index for the search function, it picks it up along with the next catalogue version
+    words = searchIndex.build_index((listing.sku, [listing.name, listing.type, listing.category]) for listing in listings)
+    print("Search index of {} terms, {} bytes".format(len(words['terms']), metaStore.save_blob(searchIndex.BLOB_NAME, words)))
 
-def lambda_handler(event, context):
-    t = dt.now()
-    success = update_product_cache()
-    if success:
-        print("Cache updated in {}!".format(dt.now()-t))
+    # Only new skus, ones that changed on BC Liquor's browse page and ones that are too stale need their stock checked
+    state = metaStore.load_blob(REFRESH_STATE) or dict()
+    now = time.time()
+    due = [listing for listing in listings if needs_refresh(listing, state.get(str(listing.sku)), now)]
+    metrics.count('listings_due', len(due))
+
+    if invoke is None:
+        summary = refresh_listings(due, state, deadline)
     else:
-        print("Cache update failed after {}".format(dt.now()-t))
-    t = dt.now()
-    clear_old_cache()
-    print("Old Cache purged in {}!".format(dt.now()-t))
+        summary = refresh_shards(due, state, deadline, invoke)
+
+    # Forget skus that have left the catalogue
+    live_skus = {str(listing.sku) for listing in listings}
+    metaStore.save_blob(REFRESH_STATE, {sku: entry for sku, entry in state.items() if sku in live_skus})
+
+    summary['unchanged'] = len(listings)-len(due)
+    print("Refresh summary: {}".format(summary))
+    for stat in ('refreshed', 'failed', 'remaining', 'skipped', 'unchanged'):
+        metrics.count('stock_' + stat, summary[stat])
+    return summary
+
+def refresh_listings(listings, state, deadline):
+    # Refresh as much as we can before the deadline, stalest first. Updates state in place
+    last_checked = {int(sku): entry[0] for sku, entry in state.items()}
+    refresher = inventoryRefresher.InventoryRefresher(req, deadline)
+    with dbUtils.BatchWriter(get_table()) as writer:
+        write_listings(writer, refresher.refresh(listings, last_checked), state)
+    # write_listings records what it queued, anything that never made it to the table has to look new to the next run
+    for item in writer.unwritten:
+        state.pop(str(item['sku']), None)
+    # Both count retried and failed, the writer's are about items rather than skus
+    return dict(refresher.stats, written=writer.stats['written'], skipped=writer.stats['skipped'],
+                write_retried=writer.stats['retried'], write_failed=writer.stats['failed'])
+
+def make_shards(listings, state, shards):
+    # Deal skus out in priority order so every shard gets its share of the stalest and best ones
+    def priority(listing):
+        entry = state.get(str(listing.sku))
+        return (entry[0] if entry is not None else 0, -listing.adjValue)
+    ordered = sorted(listings, key=priority)
+    return [ordered[i::shards] for i in range(shards) if ordered[i::shards]]
+
+def refresh_shards(listings, state, deadline, invoke):
+    # Fan out: each shard goes to a worker invocation with its part of the refresh state. Fan in: merge the state they
+    # send back and add up their summaries. Workers are told to stop in time for us to finish before our own deadline
+    payloads = [{
+        'mode': 'worker',
+        'time_budget': deadline - time.monotonic(),
+        'listings': [listing_payload(listing) for listing in shard],
+        'state': {str(listing.sku): state[str(listing.sku)] for listing in shard if str(listing.sku) in state}
+    } for shard in make_shards(listings, state, REFRESH_SHARDS)]
+
+    summary = dict(refreshed=0, failed=0, retried=0, remaining=0, aborted=False, written=0, skipped=0, write_retried=0, write_failed=0,
+                   shards=len(payloads), failed_shards=0)
+    if not payloads:
+        return summary
+
+    with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+        results = list(executor.map(lambda payload: invoke_safely(invoke, payload), payloads))
+
+    for payload, result in zip(payloads, results):
+        if result is None:
+            summary['failed_shards'] += 1
+            summary['remaining'] += len(payload['listings'])
+            continue
+        state.update(result['state'])
+        for stat, count in result['summary'].items():
+            if stat == 'aborted':
+                summary['aborted'] = summary['aborted'] or count
+            else:
+                summary[stat] += count
+    return summary
+
+def invoke_safely(invoke, payload):
+    try:
+        return invoke(payload)
+    except Exception as e:
+        print("Shard of {} skus failed: {}".format(len(payload['listings']), e))
+        return None
+
+def refresh_shard(payload, deadline):
+    # Worker side of refresh_shards
+    listings = [listing_from_payload(data) for data in payload['listings']]
+    state = payload['state']
+    deadline = min(deadline, time.monotonic() + payload['time_budget'])
+    summary = refresh_listings(listings, state, deadline)
+    print("Shard summary: {}".format(summary))
+    return {'summary': summary, 'state': state}
+
+def listing_payload(listing):
+    return {'name': listing.name, 'price': listing.price, 'drink_type': listing.type, 'count': listing.count, 'volume': listing.volume,
+            'alcPerc': listing.alcPerc, 'category': listing.category, 'rating': listing.rating, 'sku': listing.sku, 'value': listing.value,
+            'adjValue': listing.adjValue, 'sale': listing.sale, 'image': listing.image, 'browse_fp': listing.browse_fp}
+
+def listing_from_payload(data):
+    data = dict(data)
+    browse_fp = data.pop('browse_fp')
+    listing = Listing(**data)
+    listing.browse_fp = browse_fp
+    return listing
+
+def lambda_invoker(context):
+    # Workers are this same function, invoked synchronously from a thread each so we can wait on all of them at once
+    import boto3
+    from botocore.config import Config
+    client = boto3.client('lambda', config=Config(read_timeout=900, retries={'max_attempts': 0}))
+    def invoke(payload):
+        res = client.invoke(FunctionName=context.invoked_function_arn, InvocationType='RequestResponse', Payload=json.dumps(payload))
+        if 'FunctionError' in res:
+            raise RuntimeError(res['Payload'].read().decode('utf-8'))
+        return json.loads(res['Payload'].read())
+    return invoke
+
+def invoke_locally(payload):
+    # Stands in for lambda_invoker when running everything in one process, payload goes through json like a real invoke
+    return json.loads(json.dumps(lambda_handler(json.loads(json.dumps(payload)), None)))
+
+def needs_refresh(listing, entry, now):
+    if entry is None or len(entry) < 4:
+        return True
+    return entry[3] != listing.browse_fp or now - entry[0] > MAX_STALENESS
+
+def write_listings(writer, refreshed, state):
+    # Only write listings that changed since we last wrote them. With scan expiry anything refreshed since the last purge
+    # is still in the table, with TTL expiry listings are rewritten often enough that expires_at never passes while they're live
+    now = time.time()
+    for listing, inventory in refreshed:
+        item = listing_item(listing, inventory)
+        item_fingerprint = dbUtils.fingerprint(item, ignore=('last_updated', 'expires_at'))
+        previous = state.get(str(listing.sku))
+        if previous is not None and len(previous) > 2 and previous[1] == item_fingerprint and still_cached(previous, now):
+            writer.skip()
+            state[str(listing.sku)] = [int(now), item_fingerprint, previous[2], listing.browse_fp]
+        else:
+            writer.put(item)
+            state[str(listing.sku)] = [int(now), item_fingerprint, int(now), listing.browse_fp]
+
+def still_cached(entry, now):
+    if EXPIRY_MODE == 'ttl':
+        return now - entry[2] < CACHE_EXPIRY/2
+    return now - entry[0] < CACHE_EXPIRY
+
+def listing_item(listing, inventory):
+    item = {
+        'sku': decimal.Decimal(listing.sku),
+        'name': listing.name,
+        'price': decimal.Decimal(str(listing.price)),
+        'type': listing.type,
+        'count': decimal.Decimal(str(listing.count)),
+        'volume': decimal.Decimal(str(listing.volume)),
+        'alcPerc': decimal.Decimal(str(listing.alcPerc)),
+        'category': listing.category,
+        'rating': decimal.Decimal(str(listing.rating)),
+        'value': decimal.Decimal(str(listing.value)),
+        'adjValue': decimal.Decimal(str(listing.adjValue)),
+        'sale': decimal.Decimal(str(listing.sale)),
+        'image': listing.image,
+        'image_ok': listing.image is not None, # resolve_images leaves image as None if nothing worked
+        'inventory': inventory,
+        'last_updated': decimal.Decimal(str(time.time()))
+    }
+    if EXPIRY_MODE == 'ttl':
+        item['expires_at'] = int(time.time() + CACHE_EXPIRY)
+    return item
+
+def lambda_handler(event, context):
+    # Stop starting inventory requests with enough time left to finish up
+    remaining = context.get_remaining_time_in_millis()/1000 if context is not None else 900
+    deadline = time.monotonic() + remaining - inventoryRefresher.DEADLINE_MARGIN
+
+    if event.get('mode') == 'worker':
+        # Run in process by invoke_locally (no context) a worker's metrics go in with the invocation that called it
+        try:
+            with metrics.span('refresh'):
+                return refresh_shard(event, deadline)
+        finally:
+            if context is not None:
+                metrics.flush('cache_worker')
+
+    try:
+        invoke = lambda_invoker(context) if REFRESH_SHARDS > 1 and context is not None else None
+        with metrics.span('refresh') as refresh:
+            summary = update_product_cache(deadline, invoke)
+        if summary is not None and not summary['aborted']:
+            print("Cache updated in {:.0f}ms!".format(refresh.ms))
+        else:
+            print("Cache update failed after {:.0f}ms".format(refresh.ms))
+        with metrics.span('purge') as purge:
+            purged = clear_old_cache()
+        print("Old Cache purged ({} listings) in {:.0f}ms!".format(purged, purge.ms))
+        metrics.count('purged', purged)
+
+        # Tell warm search containers to rebuild their index
+        if purged or (summary is not None and summary['written']):
+            print("Catalogue version {}".format(metaStore.bump_catalogue_version()))
 
-    return
+        return summary
+    finally:
+        metrics.flush('cache')
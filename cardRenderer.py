@@ -0,0 +1,50 @@
+import re
+
+# Turns the Block Kit templates from the env vars into render functions once per container.
+# Parts of a template without a {placeholder} are shared between every render instead of copied, so treat rendered
+# blocks as read only. They only ever get serialised to json so this is fine
+
+PLACEHOLDER = re.compile(r'\{(\w+)\}')
+
+
+class Fields(dict):
+    # Placeholders we weren't given are left as they are, same as str.replace would
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+def compile_string(text):
+    names = PLACEHOLDER.findall(text)
+    if not names:
+        return None
+    # Escape everything that isn't a placeholder so str.format_map can fill them all in one call
+    parts = PLACEHOLDER.split(text)
+    fmt = ''.join(part.replace('{', '{{').replace('}', '}}') if i % 2 == 0 else '{' + part + '}' for i, part in enumerate(parts))
+    return fmt.format_map
+
+
+def compile_node(node):
+    # Returns a function that renders the node from a Fields mapping, or None if the node has no placeholders
+    if isinstance(node, str):
+        return compile_string(node)
+
+    if isinstance(node, dict):
+        parts = [(key, value, compile_node(value)) for key, value in node.items()]
+        if all(render is None for key, value, render in parts):
+            return None
+        return lambda fields: {key: (render(fields) if render is not None else value) for key, value, render in parts}
+
+    if isinstance(node, list):
+        parts = [(value, compile_node(value)) for value in node]
+        if all(render is None for value, render in parts):
+            return None
+        return lambda fields: [render(fields) if render is not None else value for value, render in parts]
+
+    return None
+
+
+def compile_template(template):
+    render = compile_node(template)
+    if render is None:
+        return lambda fields: template
+    return lambda fields: render(Fields(fields))
@@ -1,185 +1,409 @@
 import json
 import os
 import requests
-import boto3
-import decimal
 import copy
-from datetime import datetime as dt
+import time
+import bisect
+import functools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import metaStore
+import metrics
+import dbUtils
+import cardRenderer
+import resultCache
+import scoring
+import searchIndex
+import productListing
 
 TOP_N_RESULTS = int(os.environ['TOP_N_RESULTS'])
-RETURN_MODAL_TEMPLATE = json.loads(os.environ['RETURN_MODAL_TEMPLATE'])
-MODAL_DRINK_CARD_TEMPLATE = json.loads(os.environ['MODAL_DRINK_CARD_TEMPLATE'])
-MODAL_LOCATION_CARD_TEMPLATE = json.loads(os.environ['MODAL_LOCATION_CARD_TEMPLATE'])
-DIVIDER_TEMPLATE = json.loads(os.environ['DIVIDER_TEMPLATE'])
 PRODUCT_URL_BASE = os.environ['PRODUCT_URL_BASE']
 NOT_FOUND_IMAGE = os.environ['NOT_FOUND_IMAGE']
-STORE_NAME_MAP = json.loads(os.environ['STORE_NAME_MAP'])
 BOT_TOKEN = os.environ["BOT_TOKEN"]
-RETURN_NO_RESULTS = json.loads(os.environ['RETURN_NO_RESULTS'])
 
 PRODUCT_TABLE = os.environ['PRODUCT_TABLE']
-table = boto3.resource('dynamodb').Table(PRODUCT_TABLE)
+INDEX_MAX_AGE = int(os.environ.get('INDEX_MAX_AGE', 3600))  # Rebuild the index at least this often even if the version stamp didn't change
+PRICE_STEP = 256
+# Set it to the cache function's EXPIRY_MODE. With "ttl" expired listings are left out of the index, DynamoDB can take days to delete them
+EXPIRY_MODE = os.environ.get('EXPIRY_MODE', 'scan')
+# "trust" uses the image_ok flag the refresh job stored, "verify" also checks the shown images while the user waits
+IMAGE_CHECK_MODE = os.environ.get('IMAGE_CHECK_MODE', 'trust')
+IMAGE_CHECK_DEADLINE = float(os.environ.get('IMAGE_CHECK_DEADLINE', 1.5))  # seconds for all checks together
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', 8))  # Cards rendered at once, each one waits on its image check in verify mode
+# Post the header and this many cards as soon as they're ready, then replace the message with every card. 0 posts once
+PROGRESSIVE_CARDS = int(os.environ.get('PROGRESSIVE_CARDS', 0))
+
+# Anything slow to set up is left until a search needs it so a cold start gets to the result cache as soon as possible
+table = None
+wire_client = None
+
+def get_table():
+    global table
+    if table is None:
+        import boto3
+        table = boto3.resource('dynamodb').Table(PRODUCT_TABLE)
+    return table
+
+def get_wire_client():
+    # Plain client for the index scan, its items come back in DynamoDB's wire format without a Decimal for every number
+    global wire_client
+    if wire_client is None:
+        import boto3
+        wire_client = boto3.client('dynamodb')
+    return wire_client
+
+@functools.lru_cache(maxsize=None)
+def template(name):
+    # Block Kit templates (and the store name map) are JSON env vars, parsed the first time they're used
+    return json.loads(os.environ[name])
+
+@functools.lru_cache(maxsize=None)
+def renderer(name):
+    return cardRenderer.compile_template(template(name))
+
+@functools.lru_cache(maxsize=None)
+def modal_header():
+    # Header never changes between searches so build it once
+    header = copy.deepcopy(template('RETURN_MODAL_TEMPLATE')['blocks'])
+    header[0]['text']['text'] = header[0]['text']['text'].replace('N', str(TOP_N_RESULTS))
+    header.append(template('DIVIDER_TEMPLATE'))
+    return header
 
 req = requests.Session()
 req.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:60.0) Gecko/20100101 Firefox/60.0'})
 
-class Listing:
-    def __init__(self, name, price, drink_type, count, volume, alcPerc, category, rating, sku, value, adjValue, sale, image):
-        self.name = name
-        self.price = price
-        self.type = drink_type.lower() if drink_type is not None else None
-        self.count = count
-        self.volume = volume
-        self.alcPerc = alcPerc
-        self.category = category.lower() if category is not None else None
-        self.rating = rating
-        self.sku = sku
-        self.value = value
-        self.adjValue = adjValue
-        self.sale = sale
-        self.image = image
-        
-        # To later store inventory (store:stock)
-        self.inventory = dict()
+class ProductIndex:
+    # Whole catalogue held in memory, ranked by adjValue. Positions below are indexes into self.listings
+    def __init__(self, listings, version, words=None):
+        import numpy as np
+        self.version = version
+        self.built = time.time()
+        self.listings = sorted(listings, key=lambda listing: listing.adjValue, reverse=True)
 
-    def __eq__(self, other):
-        return other and self.sku == other.sku # Shouldn't be duplicate SKUs in BC liquor's stock
+        # Raw scoring inputs as columns in rank order so custom weights can re-score everything in one go.
+        # value is the rounded one we display so re-scored numbers can be a little off adjValue
+        self.values = np.array([float(listing.value) for listing in self.listings])
+        self.ratings = np.array([listing.rating for listing in self.listings])
+        self.sales = np.array([listing.sale for listing in self.listings])
 
-    def __hash__(self):
-        return hash((self.sku, self.name))
-        
-def process_search(maxPrice=0, drink_type="all", filterStores=[], only_open_stores=True, response_url=None, trigger_id=None):
-    # Query cache, filtering on applicable criteria
-    # Not a great way to represent max price, ideally we would multiply item's price by 1.15(15% tax) but dynamodb doesn't support math in queries
-    # t = dt.now()
-    response = table.scan(
-        FilterExpression = "(price <= :maxPrice OR :maxPrice <= :zero) \
-                            AND (:drink_type = :all \
-                                OR (contains(#drink_type, :drink_type) \
-                                    OR contains(category, :drink_type)))",
-        ExpressionAttributeValues = {":maxPrice": decimal.Decimal(maxPrice*0.87),
-                                    ":drink_type": drink_type,
-                                    ":all": "all",
-                                    ":zero": decimal.Decimal(0)
-        },  
-        ProjectionExpression = 'sku, #prod_name, #drink_type, category, price, inventory, #cash_value, adjValue, alcPerc, #count_in_box, volume, rating, sale, image',
-        ExpressionAttributeNames={
-                '#prod_name': 'name',
-                '#drink_type': 'type',
-                '#count_in_box': 'count',
-                '#cash_value': 'value'
-        }
-    )
-    # print(dt.now()-t)
-    # print("DB returned response:")
-    # print(response)
-    # Create listing objects for items in stock at a store we're searching for
+        # Every filter is a bitset over rank positions (bit 0 is the best listing), so combining filters is just & and |
+        self.all_bits = (1 << len(self.listings)) - 1
+
+        # type/category: positions that have it
+        self.postings = dict()
+        # store number: positions with stock there
+        self.store_bits = dict()
+        for pos, listing in enumerate(self.listings):
+            bit = 1 << pos
+            for token in {listing.type, listing.category}:
+                if token is not None:
+                    self.postings[token] = self.postings.get(token, 0) | bit
+            for store, stock in listing.inventory.items():
+                if stock > 0:
+                    self.store_bits[store] = self.store_bits.get(store, 0) | bit
+        self.term_cache = dict()
+
+        # Word index from the refresh job, its postings are skus and get turned into bitsets the first time they're used
+        self.words = words
+        self.word_bits = dict()  # term id: bitset
+        skus = np.array([int(listing.sku) for listing in self.listings], dtype=np.int64)
+        self.sku_order = np.argsort(skus)
+        self.sorted_skus = skus[self.sku_order]
+
+        # Positions ordered by price, with a parallel list of prices to bisect on. price_steps[i] has the bits for the
+        # cheapest i*PRICE_STEP listings so a price filter only needs to set the last few bits by hand
+        self.by_price = sorted(range(len(self.listings)), key=lambda pos: self.listings[pos].price)
+        self.prices = [self.listings[pos].price for pos in self.by_price]
+        self.price_steps = [0]
+        mask = 0
+        for i, pos in enumerate(self.by_price, 1):
+            mask |= 1 << pos
+            if i % PRICE_STEP == 0:
+                self.price_steps.append(mask)
+
+    def term_bits(self, term):
+        if term == 'all':
+            return self.all_bits
+        if term not in self.term_cache:
+            if self.words is not None:
+                self.term_cache[term] = self.match_words(term)
+            else:
+                self.term_cache[term] = self.match_types(term)
+        return self.term_cache[term]
+
+    def match_types(self, term):
+        # Same matching as contains(type, term) OR contains(category, term) but over the handful of distinct types/categories.
+        # Only used until the refresh job has stored a word index
+        mask = 0
+        for token, posting in self.postings.items():
+            if term in token:
+                mask |= posting
+        return mask
+
+    def match_words(self, term):
+        # Every word of the search has to match a word of the name, type or category. A word matches the terms it's a
+        # prefix of, or failing that the terms it's a typo away from
+        words = searchIndex.tokenize(term)
+        if not words or not self.listings:
+            return self.all_bits
+        mask = self.all_bits
+        for word in words:
+            word_mask = 0
+            for term_id in self.words.lookup(word):
+                word_mask |= self.term_id_bits(term_id)
+            mask &= word_mask
+            if not mask:
+                break
+        return mask
+
+    def term_id_bits(self, term_id):
+        if term_id not in self.word_bits:
+            # Skus the product table doesn't have (yet) are dropped
+            import numpy as np
+            skus = self.words.postings[term_id]
+            found = np.minimum(np.searchsorted(self.sorted_skus, skus), len(self.listings) - 1)
+            found = found[self.sorted_skus[found] == skus]
+            self.word_bits[term_id] = scoring.positions_to_bits(self.sku_order[found], len(self.listings))
+        return self.word_bits[term_id]
+
+    def price_bits(self, price_limit):
+        if price_limit is None:
+            return self.all_bits
+        cheaper = bisect.bisect_right(self.prices, price_limit)
+        step = cheaper // PRICE_STEP
+        mask = self.price_steps[step]
+        for pos in self.by_price[step*PRICE_STEP:cheaper]:
+            mask |= 1 << pos
+        return mask
+
+    def store_bits_any(self, stores):
+        mask = 0
+        for store in stores:
+            mask |= self.store_bits.get(store, 0)
+        return mask
+
+    def search(self, price_limit, term, stores, n, weights=None):
+        # Best n positions in stock at any of the stores that match the filters, fewer if that's all there is.
+        # price_limit of None means no limit, weights of None means rank by the stored adjValue
+        mask = self.store_bits_any(stores)
+        if mask:
+            mask &= self.term_bits(term)
+        if mask:
+            mask &= self.price_bits(price_limit)
+        if weights is None:
+            return first_set_bits(mask, n)
+
+        candidates = scoring.bits_to_positions(mask, len(self.listings))
+        candidate_scores = scoring.scores(self.values[candidates], self.ratings[candidates], self.sales[candidates], weights)
+        return candidates[scoring.top_n(candidate_scores, n)].tolist()
+
+def first_set_bits(mask, n):
+    positions = []
+    while mask and len(positions) < n:
+        lowest = mask & -mask
+        positions.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return positions
+
+_index = None
+results = resultCache.ResultCache()
+
+def get_index(version):
+    # Kept between invocations in a warm container, only rebuilt when the refresh job bumps the catalogue version
+    global _index
+    if _index is None or _index.version != version or time.time() - _index.built > INDEX_MAX_AGE:
+        with metrics.span('index_build') as build:
+            expiry = dict()
+            if EXPIRY_MODE == 'ttl':
+                # TTL deletes don't bump the catalogue version either, INDEX_MAX_AGE is what drops them from a warm index
+                expiry = dict(FilterExpression='attribute_not_exists(expires_at) OR expires_at > :now',
+                              ExpressionAttributeValues={':now': {'N': str(int(time.time()))}})
+            items = dbUtils.scan_items(get_table(), client=get_wire_client(),
+                ProjectionExpression = 'sku, #prod_name, #drink_type, category, price, inventory, #cash_value, adjValue, alcPerc, #count_in_box, volume, rating, sale, image, image_ok',
+                ExpressionAttributeNames={
+                        '#prod_name': 'name',
+                        '#drink_type': 'type',
+                        '#count_in_box': 'count',
+                        '#cash_value': 'value'
+                },
+                **expiry
+            )
+            words = metaStore.load_blob(searchIndex.BLOB_NAME)
+            _index = ProductIndex(map(productListing.listing_from_wire, items), version, searchIndex.SearchIndex(words) if words is not None else None)
+        print("Built index of {} listings for catalogue version {} in {:.0f}ms".format(len(_index.listings), version, build.ms))
+    return _index
+
+def process_search(maxPrice=0, drink_type="all", filterStores=[], only_open_stores=True, response_url=None, trigger_id=None, weights=None):
+    t = time.perf_counter()
+    timings = dict()
+    weights = scoring.merge_weights(weights)
+    version = metaStore.get_value(metaStore.CATALOGUE_VERSION)
+
+    def post_first_cards(user_return_modal):
+        post_results(response_url, user_return_modal)
+        timings['first_card'] = time.perf_counter() - t
+
+    # Someone asked for the same thing since the catalogue last changed, send them the same answer
+    key = resultCache.search_key(maxPrice, drink_type, filterStores, weights)
+    user_return_modal = results.get(key, version)
+    if user_return_modal is None:
+        metrics.count('result_cache_misses')
+        user_return_modal, complete = build_results(get_index(version), maxPrice, drink_type, filterStores, weights, post_first_cards if PROGRESSIVE_CARDS else None)
+        # A card that fell back on the not found image after a slow check would be served to everyone until the catalogue changes
+        if complete:
+            results.put(key, version, user_return_modal)
+        else:
+            print("Not caching result for {}, an image check timed out".format(key))
+    else:
+        metrics.count('result_cache_hits')
+        print("Cached result for {}".format(key))
+
+    # Replaces the first cards' message if there was one
+    post_results(response_url, user_return_modal, replace='first_card' in timings)
+    timings['total'] = time.perf_counter() - t
+    timings.setdefault('first_card', timings['total'])
+    print("Time to first card {:.0f}ms, total {:.0f}ms".format(timings['first_card']*1000, timings['total']*1000))
+    metrics.add_time('first_card', timings['first_card']*1000)
+    metrics.add_time('search', timings['total']*1000)
+    metrics.set_property('catalogue_version', version)
+    return
+
+def build_results(index, maxPrice, drink_type, filterStores, weights, first_cards=None):
+    # first_cards is called with the header and the first PROGRESSIVE_CARDS cards once they're rendered, if there are more to come.
+    # Returns the modal and whether every card was rendered without an image check timing out
+    # Not a great way to represent max price, ideally we would multiply item's price by 1.15(15% tax) but it was stored pre-tax
+    price_limit = maxPrice*0.87 if maxPrice > 0 else None
+
+    # Create listing objects for the best items in stock at a store we're searching for
     listings = []
     desired_stores = set(map(str, filterStores))
-    response['Items'].sort(key=lambda x: x['adjValue'], reverse=True)
-    i = 0
-    while(len(listings) < TOP_N_RESULTS):
-        elem = response['Items'][i]
-        stores_in_stock = desired_stores & set([i for i in elem['inventory'].keys()])
-        if len(stores_in_stock) > 0:
-            listing = Listing(name=elem['name'], 
-                            price=float(elem['price']), 
-                            drink_type=elem['type'], 
-                            count=int(elem['count']), 
-                            volume=float(elem['volume']), 
-                            alcPerc=elem['alcPerc'], 
-                            category=elem['category'], 
-                            rating=float(elem['rating']), 
-                            sku=elem['sku'], 
-                            value=elem['value'], 
-                            adjValue=float(elem['adjValue']), 
-                            sale=float(elem['sale']), 
-                            image=elem['image'])
-            
-            listing.inventory = {k:int(v) for k,v in elem['inventory'].items() if int(k) in filterStores}
-            listings.append(listing)
-        else:
-            print(f"Rejecting {elem['name']}, not in stock at {','.join(desired_stores)}")
-            
-        i+=1
+    with metrics.span('filter'):
+        positions = index.search(price_limit, drink_type.lower(), desired_stores, TOP_N_RESULTS, weights)
+    metrics.count('results', len(positions))
+    for pos in positions:
+        elem = index.listings[pos]
+        listing = copy.copy(elem)
+        listing.inventory = {k:v for k,v in elem.inventory.items() if k in desired_stores and v > 0}
+        if weights is not None:
+            listing.adjValue = round(scoring.adj_value(float(elem.value), elem.rating, elem.sale, weights), 1)
+        listings.append(listing)
         
-    user_return_modal = copy.deepcopy(RETURN_MODAL_TEMPLATE)
-    user_return_modal['blocks'][0]['text']['text'] = user_return_modal['blocks'][0]['text']['text'].replace('N', str(TOP_N_RESULTS))
-    user_return_modal['blocks'].append(DIVIDER_TEMPLATE)
+    user_return_modal = {'text': template('RETURN_MODAL_TEMPLATE')['text'], 'blocks': list(modal_header())}
 
     # Fill in modal to return to user
-    emptyCheck = False
-    for listing in listings:
-        emptyCheck = True
-        print("Processing {}".format(listing.name))
-        card = copy.deepcopy(MODAL_DRINK_CARD_TEMPLATE)
-        location = copy.deepcopy(MODAL_LOCATION_CARD_TEMPLATE)
-
-        if listing.volume >= 1:
-            volume = '{}L'.format(listing.volume)
-        elif listing.count > 1:
-            volume = '{}x{}ml cans'.format(listing.count, listing.volume*1000)
-        else:
-            volume = '{}mL'.format(listing.volume*1000)
-            
-        stars = listing.rating*0.75 if listing.rating <= 3 else round(listing.rating, 0)
-        # Price has tax and bottle deposit added
-        if listing.count == 1:
-            volume = volume.replace('s','')
-            
-        if listing.sale > 0:
-            sale = " *_{}% off_*".format(round(listing.sale, 0))
-        else:
-            sale = ""
-        
-        card['text']['text'] = card['text']['text'] \
-            .replace('{liquor_link}', PRODUCT_URL_BASE+str(listing.sku)) \
-            .replace('{drink_name}', listing.name) \
-            .replace('{volume}', volume) \
-            .replace('{alcPerc}', str(listing.alcPerc)) \
-            .replace('{score}', str(listing.adjValue)) \
-            .replace('{price}', str(round((listing.price*1.15+(0.1*listing.count if listing.count > 1 else 0.2)),2))) \
-            .replace('{value}', str(listing.value)) \
-            .replace('{rating}', int(round(listing.rating, 0)) * '★') \
-            .replace('{sale}', sale)
-        
-        if listing.image != None and requests.head(listing.image, verify=False, timeout=2).status_code == 200:
-            card['accessory']['image_url'] = listing.image
-        else:
-            print(f"Invalid image: {listing.image}")
-            card['accessory']['image_url'] = NOT_FOUND_IMAGE
-        t = dt.now()
-        stores_string = ""
-        for store, stock in listing.inventory.items():
-            stores_string+=("{}({} in stock)\n".format(STORE_NAME_MAP[store], stock))
-
-        location['elements'][1]['text'] = location['elements'][1]['text'].replace('{locations}', stores_string)
-        
-        user_return_modal['blocks'].append(card)
-        user_return_modal['blocks'].append(location)
-        user_return_modal['blocks'].append(DIVIDER_TEMPLATE)
-        print(dt.now()-t)
+    complete = True
+    for rendered, (blocks, checked) in enumerate(render_cards(listings), 1):
+        user_return_modal['blocks'].extend(blocks)
+        complete = complete and checked
+        if first_cards is not None and rendered == PROGRESSIVE_CARDS and len(listings) > rendered:
+            first_cards({'text': user_return_modal['text'], 'blocks': list(user_return_modal['blocks'])})
         
-    if not emptyCheck:
+    if not listings:
         # return this to user if no results match their search
-        return_results = copy.deepcopy(RETURN_NO_RESULTS)
-        user_return_modal['blocks'].append(return_results)
+        user_return_modal['blocks'].append(template('RETURN_NO_RESULTS'))
         
-    #print(user_return_modal)
-    
+    return user_return_modal, complete
+
+def post_results(response_url, user_return_modal, replace=False):
     try:
         print("URL: {}".format(response_url))
         print("JSON: {}".format(json.dumps(user_return_modal)))
-        res = req.post(response_url, headers={'Authorization': BOT_TOKEN, 'Content-type': 'application/json'}, json={"text": user_return_modal['text'],"blocks": user_return_modal['blocks']})
+        message = {"text": user_return_modal['text'],"blocks": user_return_modal['blocks']}
+        if replace:
+            message['replace_original'] = True
+        metrics.count('slack_posts')
+        with metrics.span('slack_post'):
+            res = req.post(response_url, headers={'Authorization': BOT_TOKEN, 'Content-type': 'application/json'}, json=message)
         print(res.text)
     except Exception as e:
         print(e)
         
-    return
+def render_cards(listings):
+    # Yields each listing's blocks in rank order as soon as it and every card above it are done, along with False if its
+    # image check timed out. In verify mode the cards are rendered by a pool so their image checks overlap, and whatever
+    # hasn't finished by the deadline is rendered with the not found image instead
+    if IMAGE_CHECK_MODE != 'verify' or not listings:
+        for listing in listings:
+            yield card_blocks(listing, listing.image_ok), True
+        return
+
+    deadline = time.monotonic() + IMAGE_CHECK_DEADLINE
+    executor = ThreadPoolExecutor(max_workers=min(RENDER_WORKERS, len(listings)))
+    try:
+        futures = [executor.submit(verified_card_blocks, listing) for listing in listings]
+        for listing, future in zip(listings, futures):
+            try:
+                blocks = future.result(timeout=max(0, deadline - time.monotonic()))
+            except TimeoutError:
+                print(f"Image check for {listing.name} didn't finish in time")
+                yield card_blocks(listing, False), False
+            else:
+                yield blocks, True
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def verified_card_blocks(listing):
+    return card_blocks(listing, listing.image_ok and image_exists(listing.image))
+
+@metrics.span('render')
+def card_blocks(listing, image_ok):
+    print("Processing {}".format(listing.name))
+    return [renderer('MODAL_DRINK_CARD_TEMPLATE')(card_fields(listing, image_ok)),
+            renderer('MODAL_LOCATION_CARD_TEMPLATE')({'locations': location_text(listing)}),
+            template('DIVIDER_TEMPLATE')]
+
+@metrics.span('image_check')
+def image_exists(image):
+    try:
+        return req.head(image, verify=False, timeout=IMAGE_CHECK_DEADLINE).status_code == 200
+    except requests.exceptions.RequestException:
+        return False
+
+def card_fields(listing, image_ok):
+    if listing.volume >= 1:
+        volume = '{}L'.format(listing.volume)
+    elif listing.count > 1:
+        volume = '{}x{}ml cans'.format(listing.count, listing.volume*1000)
+    else:
+        volume = '{}mL'.format(listing.volume*1000)
         
+    if listing.count == 1:
+        volume = volume.replace('s','')
+        
+    if listing.sale > 0:
+        sale = " *_{}% off_*".format(round(listing.sale, 0))
+    else:
+        sale = ""
+
+    if image_ok:
+        image_url = listing.image
+    else:
+        print(f"Invalid image: {listing.image}")
+        image_url = NOT_FOUND_IMAGE
+
+    return {
+        'liquor_link': PRODUCT_URL_BASE+str(listing.sku),
+        'drink_name': listing.name,
+        'volume': volume,
+        'alcPerc': str(listing.alcPerc),
+        'score': str(listing.adjValue),
+        # Price has tax and bottle deposit added
+        'price': str(round((listing.price*1.15+(0.1*listing.count if listing.count > 1 else 0.2)),2)),
+        'value': str(listing.value),
+        'rating': int(round(listing.rating, 0)) * '★',
+        'sale': sale,
+        'image_url': image_url
+    }
+
+def location_text(listing):
+    store_names = template('STORE_NAME_MAP')
+    return ''.join("{}({} in stock)\n".format(store_names[store], stock) for store, stock in listing.inventory.items())
+
 def lambda_handler(event, context):
-    process_search(event['max_price'], event['search_term'], event['stores'], False, event['response_url'], event['trigger_id'])
-    
+    try:
+        process_search(event['max_price'], event['search_term'], event['stores'], False, event['response_url'], event['trigger_id'], event.get('weights'))
+    finally:
+        metrics.flush('search')
+
     return {
         'statusCode': 200,
         'body': json.dumps('Success')
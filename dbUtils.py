@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+
+import metrics
+
+BATCH_SIZE = 25  # Max items per BatchWriteItem call
+BATCH_RETRIES = 5
+BATCH_BACKOFF = 0.5  # seconds, doubled after every round of unprocessed items
+SCAN_SEGMENTS = int(os.environ.get('SCAN_SEGMENTS', 4))  # Parallel scan segments, each one runs in its own thread
+
+
+def fingerprint(item, ignore=('last_updated',)):
+    # Short stable hash of an item's attributes, used to tell if anything changed since it was last written
+    data = json.dumps({k: v for k, v in item.items() if k not in ignore}, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class BatchWriter:
+    # Like table.batch_writer() but backs off between UnprocessedItems retries and keeps count of what it did.
+    # Whatever it gave up on ends up in unwritten, items for puts and keys for deletes
+    def __init__(self, table, batch_size=BATCH_SIZE):
+        self.table = table
+        self.batch_size = batch_size
+        self.pending = []
+        self.unwritten = []
+        self.stats = dict(written=0, skipped=0, retried=0, failed=0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def put(self, item):
+        self.pending.append({'PutRequest': {'Item': item}})
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def delete(self, key):
+        self.pending.append({'DeleteRequest': {'Key': key}})
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def skip(self):
+        self.stats['skipped'] += 1
+
+    def flush(self):
+        if not self.pending:
+            return
+        requests = self.pending
+        self.pending = []
+        for attempt in range(BATCH_RETRIES + 1):
+            metrics.count('dynamodb_write_requests')
+            with metrics.span('dynamodb_write'):
+                res = self.table.meta.client.batch_write_item(RequestItems={self.table.name: requests})
+            unprocessed = res.get('UnprocessedItems', {}).get(self.table.name, [])
+            self.stats['written'] += len(requests) - len(unprocessed)
+            metrics.count('dynamodb_items_written', len(requests) - len(unprocessed))
+            if not unprocessed:
+                return
+            requests = unprocessed
+            if attempt < BATCH_RETRIES:
+                self.stats['retried'] += len(requests)
+                metrics.count('dynamodb_write_retries', len(requests))
+                time.sleep(BATCH_BACKOFF * 2**attempt)
+
+        print(f"Gave up on {len(requests)} unprocessed items")
+        self.stats['failed'] += len(requests)
+        self.unwritten.extend(request['PutRequest']['Item'] if 'PutRequest' in request else request['DeleteRequest']['Key'] for request in requests)
+        metrics.count('dynamodb_write_failures', len(requests))
+
+
+def scan_pages(table, segment=None, total_segments=None, client=None, **kwargs):
+    # Follows LastEvaluatedKey so scans past 1MB don't silently stop early. Pass a plain boto3.client('dynamodb') as
+    # client to get items in DynamoDB's wire format instead of the table's Decimal converted ones
+    client = client or table.meta.client
+    if total_segments is not None:
+        kwargs.update(Segment=segment, TotalSegments=total_segments)
+    while True:
+        with metrics.span('scan'):
+            res = client.scan(TableName=table.name, **kwargs)
+        metrics.count('scan_items', len(res['Items']))
+        yield res['Items']
+        if 'LastEvaluatedKey' not in res:
+            return
+        kwargs['ExclusiveStartKey'] = res['LastEvaluatedKey']
+
+
+def scan_items(table, segments=SCAN_SEGMENTS, client=None, **kwargs):
+    # Streams every item matching the scan. With more than one segment the table is read by that many threads at once
+    # and items come out in whatever order the pages arrive. Takes the same keyword arguments as table.scan
+    if segments <= 1:
+        for page in scan_pages(table, client=client, **kwargs):
+            yield from page
+        return
+
+    pages = queue.Queue(maxsize=segments * 2)
+    stop = threading.Event()
+
+    def put(page):
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def scan_segment(segment):
+        try:
+            for page in scan_pages(table, segment, segments, client, **kwargs):
+                if stop.is_set():
+                    return
+                put(page)
+            put(None)
+        except Exception as e:
+            put(e)
+
+    threads = [threading.Thread(target=scan_segment, args=(segment,), daemon=True) for segment in range(segments)]
+    for thread in threads:
+        thread.start()
+    try:
+        finished = 0
+        while finished < segments:
+            page = pages.get()
+            if page is None:
+                finished += 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield from page
+    finally:
+        stop.set()
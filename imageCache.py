@@ -0,0 +1,115 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import metaStore
+import metrics
+
+IMAGE_TTL = int(os.environ.get('IMAGE_TTL', 7 * 86400))  # How long a working image is trusted before we check it again
+MISSING_IMAGE_TTL = int(os.environ.get('MISSING_IMAGE_TTL', 86400))  # Same for images we couldn't find
+MAX_IMAGE_WORKERS = int(os.environ.get('MAX_IMAGE_WORKERS', 16))
+BLOB_NAME = 'image_cache'
+
+
+class ImageCache:
+    # Entries are stored as sku: [source url, resolved image or None, time checked, last image that ever resolved or None]
+    def __init__(self, entries=None):
+        self.entries = entries or dict()
+
+    @classmethod
+    def load(cls):
+        return cls(metaStore.load_blob(BLOB_NAME))
+
+    def save(self):
+        metaStore.save_blob(BLOB_NAME, self.entries)
+
+    def lookup(self, sku, source, now=None):
+        # Returns (hit, image). A hit with image None is a cached "not found"
+        entry = self.entries.get(str(sku))
+        if entry is None or entry[0] != source:
+            return False, None
+        ttl = IMAGE_TTL if entry[1] is not None else MISSING_IMAGE_TTL
+        if (now or time.time()) - entry[2] > ttl:
+            return False, None
+        return True, entry[1]
+
+    def previously_resolved(self, sku):
+        entry = self.entries.get(str(sku))
+        return entry[3] if entry is not None else None
+
+    def record(self, sku, source, image, now=None):
+        resolved = image if image is not None else self.previously_resolved(sku)
+        self.entries[str(sku)] = [source, image, int(now or time.time()), resolved]
+
+
+def image_exists(session, image):
+    metrics.count('image_checks')
+    try:
+        return session.head(image, verify=False, timeout=2).ok
+    except requests.exceptions.RequestException:
+        return False
+
+
+def find_replacement(session, name):
+    # If remote image does not exist find a suitable replacement from the web
+    print('Finding suitable replacement from web for', name)
+    formatted_search = name.replace(' ', '+')
+    img_url = 'https://www.bing.com/images/search?q=' + formatted_search
+    metrics.count('image_searches')
+    try:
+        req_img = session.get(img_url, timeout=5)
+    except requests.exceptions.RequestException as e:
+        print(f"Image search failed for {name}: {e}")
+        return None
+
+    # Only needed for the odd product with no working image, so not imported until then
+    import re
+    import bs4
+    soup = bs4.BeautifulSoup(req_img.content, 'html.parser')
+    img = soup.find('img', alt=re.compile('Image result for.*'))
+    if img is not None:
+        print('Remote image found!', img['src'])
+        return img['src']
+    print('Remote image not found :(')
+    return None
+
+
+def resolve_image(session, name, source, previous):
+    if image_exists(session, source):
+        return source
+    print('Remote image does not exist for', name)
+
+    # Only go searching the web for skus that have never had a working image
+    if previous is not None and previous != source:
+        return previous
+    if previous is None:
+        return find_replacement(session, name)
+    return None
+
+
+@metrics.span('image_resolution')
+def resolve_images(session, products, cache, max_workers=MAX_IMAGE_WORKERS):
+    # products is a list of (sku, name, source image url). Returns sku: image url or None
+    images = dict()
+    misses = []
+    now = time.time()
+    for sku, name, source in products:
+        hit, image = cache.lookup(sku, source, now)
+        if hit:
+            images[sku] = image
+        else:
+            misses.append((sku, name, source))
+
+    print(f"Image cache: {len(images)} hits, {len(misses)} to check")
+    metrics.count('image_cache_hits', len(images))
+    if misses:
+        # Images are checked with verify=False, which warns on every request otherwise
+        requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda p: resolve_image(session, p[1], p[2], cache.previously_resolved(p[0])), misses)
+            for (sku, name, source), image in zip(misses, results):
+                images[sku] = image
+                cache.record(sku, source, image, now)
+    return images
@@ -0,0 +1,152 @@
+import os
+import time
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+import metrics
+
+INVENTORY_URL = "http://www.bcliquorstores.com/ajax/get-product-inventory?sku="
+INVENTORY_RATE = float(os.environ.get('INVENTORY_RATE', 10))  # Max requests/second to BC Liquor, halved every time they push back
+MAX_INVENTORY_WORKERS = int(os.environ.get('MAX_INVENTORY_WORKERS', 8))
+INVENTORY_RETRIES = 3
+INVENTORY_BACKOFF = 1.0  # seconds, doubled after every failed attempt
+MAX_CONSECUTIVE_FAILURES = 20  # Something is wrong on their end, stop instead of hammering them
+DEADLINE_MARGIN = 60  # Seconds of lambda time to leave for the writes and cleanup after we stop
+OUT_OF_TIME = object()  # Returned instead of an inventory when a sku couldn't be fetched before the deadline
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, min_rate=0.5):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.slowed = 0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, deadline=None):
+        # Blocks until a token is available. Returns False instead if that would be after the deadline
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.rate
+            if deadline is not None and now + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def slow_down(self):
+        # Concurrent requests tend to get throttled together, only back off once per second
+        with self.lock:
+            now = time.monotonic()
+            if now - self.slowed < 1:
+                return
+            self.slowed = now
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def speed_up(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class InventoryRefresher:
+    def __init__(self, session, deadline, rate=INVENTORY_RATE, max_workers=MAX_INVENTORY_WORKERS, url=None):
+        # deadline is a time.monotonic() value, no new requests are started after it
+        self.session = session
+        self.deadline = deadline
+        self.bucket = TokenBucket(rate)
+        self.max_workers = max_workers
+        self.url = url or INVENTORY_URL
+        self.lock = threading.Lock()
+        self.stats = dict(refreshed=0, failed=0, retried=0, remaining=0, aborted=False)
+
+    def _count(self, stat, n=1):
+        with self.lock:
+            self.stats[stat] += n
+
+    def fetch_inventory(self, sku):
+        # Returns store:stock for the sku, None if BC Liquor wouldn't give it to us or OUT_OF_TIME
+        for attempt in range(INVENTORY_RETRIES + 1):
+            if not self.bucket.acquire(self.deadline):
+                return OUT_OF_TIME
+            metrics.count('inventory_requests')
+            try:
+                with metrics.span('inventory_request'):
+                    res = self.session.get(url=self.url + str(sku), timeout=10)
+                metrics.count('inventory_bytes', len(res.content), 'Bytes')
+            except requests.exceptions.RequestException as e:
+                print(f"Inventory request for {sku} failed: {e}")
+                res = None
+
+            if res is not None and res.status_code == 200:
+                self.bucket.speed_up()
+                #Dynamodb wants stock to be a string
+                return {str(store['storeNumber']): str(store['inventory']['available']) for store in res.json()}
+
+            if res is None or res.status_code == 429 or res.status_code >= 500:
+                metrics.count('inventory_throttled')
+                self.bucket.slow_down()
+            if attempt < INVENTORY_RETRIES:
+                self._count('retried')
+                metrics.count('inventory_retries')
+                retry_after = res.headers.get('Retry-After') if res is not None else None
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else INVENTORY_BACKOFF * 2**attempt
+                if time.monotonic() + delay > self.deadline:
+                    return OUT_OF_TIME
+                time.sleep(delay)
+        return None
+
+    def refresh(self, listings, last_checked):
+        # Yields (listing, inventory) as requests finish, stalest first and best adjValue first among equally stale.
+        # Anything not reached before the deadline keeps its old last_checked so it is at the front of the queue next run
+        by_sku = {listing.sku: listing for listing in listings}
+        queue = [(last_checked.get(sku, 0), -listing.adjValue, sku) for sku, listing in by_sku.items()]
+        heapq.heapify(queue)
+
+        consecutive_failures = 0
+        abandoned = 0  # Left in the queue when we gave up on BC Liquor
+        in_flight = dict()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while queue or in_flight:
+                while queue and len(in_flight) < self.max_workers and time.monotonic() < self.deadline:
+                    sku = heapq.heappop(queue)[2]
+                    in_flight[executor.submit(self.fetch_inventory, sku)] = sku
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sku = in_flight.pop(future)
+                    inventory = future.result()
+                    if inventory is OUT_OF_TIME:
+                        # Leave it for next run
+                        heapq.heappush(queue, (last_checked.get(sku, 0), -by_sku[sku].adjValue, sku))
+                        continue
+                    if inventory is None:
+                        self._count('failed')
+                        consecutive_failures += 1
+                        if consecutive_failures >= MAX_CONSECUTIVE_FAILURES and not self.stats['aborted']:
+                            print("Too many errors from BC liquor. Stopping.")
+                            self.stats['aborted'] = True
+                            abandoned = len(queue)
+                            queue.clear()
+                        continue
+
+                    consecutive_failures = 0
+                    self._count('refreshed')
+                    yield by_sku[sku], inventory
+
+        self.stats['remaining'] = len(queue) + abandoned
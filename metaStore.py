@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import zlib
+
+# Small key/value store for the bot's own bookkeeping (image cache, refresh state, catalogue version...)
+# Lives in its own table with a string partition key called "name" so it never shows up in product scans
+
+META_TABLE = os.environ['META_TABLE']
+CHUNK_SIZE = 350000  # DynamoDB items max out at 400KB
+CATALOGUE_VERSION = 'catalogue_version'  # Bumped by the refresh job whenever the product table changes
+
+table = None  # Made on first use, see get_table
+
+
+def get_table():
+    # Creating the resource is most of the cost of importing this module, so it waits until something needs the table
+    global table
+    if table is None:
+        import boto3
+        table = boto3.resource('dynamodb').Table(META_TABLE)
+    return table
+
+
+def get_value(name, default=None):
+    item = get_table().get_item(Key={'name': name}).get('Item')
+    return item['value'] if item is not None else default
+
+
+def put_value(name, value):
+    get_table().put_item(Item={'name': name, 'value': value})
+
+
+def bump_catalogue_version():
+    version = int(time.time() * 1000)
+    put_value(CATALOGUE_VERSION, version)
+    return version
+
+
+def load_blob(name):
+    # Blobs are compressed JSON split across as many items as needed. The head item points at the generation to read
+    table = get_table()
+    head = table.get_item(Key={'name': name}).get('Item')
+    if head is None:
+        return None
+    data = b''
+    for i in range(int(head['parts'])):
+        part = table.get_item(Key={'name': f"{name}#{head['generation']}#{i}"}).get('Item')
+        if part is None:
+            print(f"Blob {name} is missing part {i}, ignoring it")
+            return None
+        data += part['data'].value
+    return json.loads(zlib.decompress(data))
+
+
+def save_blob(name, obj):
+    data = zlib.compress(json.dumps(obj, separators=(',', ':')).encode('utf-8'))
+    table = get_table()
+    old = table.get_item(Key={'name': name}).get('Item')
+    generation = str(int(time.time() * 1000))
+
+    # Write the new parts before swapping the head so readers never see a half written blob
+    parts = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)] or [b'']
+    with table.batch_writer() as batch:
+        for i, part in enumerate(parts):
+            batch.put_item(Item={'name': f"{name}#{generation}#{i}", 'data': part})
+    table.put_item(Item={'name': name, 'generation': generation, 'parts': len(parts), 'size': len(data)})
+
+    if old is not None:
+        with table.batch_writer() as batch:
+            for i in range(int(old['parts'])):
+                batch.delete_item(Key={'name': f"{name}#{old['generation']}#{i}"})
+    return len(data)
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import threading
+
+# Timings and counters for one invocation, written out as a single CloudWatch Embedded Metric Format line by flush().
+# CloudWatch turns the line into metrics by itself, no API calls or extra dependencies needed.
+# Spans and counters can be used from any thread. Replace the sink to capture records instead of printing them:
+#     records = []
+#     metrics.set_sink(records.append)
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'LiquorBot')
+
+_lock = threading.Lock()
+_timings = dict()  # phase: [total ms, count]
+_counters = dict()  # name: [total, unit]
+_properties = dict()
+
+
+def print_record(record):
+    print(json.dumps(record, separators=(',', ':'), default=str))
+
+
+_sink = print_record
+
+
+def set_sink(sink):
+    # sink is called with each record dict. Returns the old one so it can be put back
+    global _sink
+    old, _sink = _sink, sink
+    return old
+
+
+class span:
+    # Times a phase, as a context manager or a decorator. Phases timed more than once (one per request, per page...)
+    # add up, and how many times they ran is recorded next to the total. ms is this run's time once the block exits
+    __slots__ = ('phase', 'start', 'ms')
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.ms = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self.start) * 1000
+        add_time(self.phase, self.ms)
+
+    def __call__(self, fn):
+        phase = self.phase
+
+        def timed(*args, **kwargs):
+            with span(phase):
+                return fn(*args, **kwargs)
+        timed.__name__ = fn.__name__
+        timed.__doc__ = fn.__doc__
+        return timed
+
+
+def add_time(phase, ms):
+    with _lock:
+        timing = _timings.get(phase)
+        if timing is None:
+            _timings[phase] = [ms, 1]
+        else:
+            timing[0] += ms
+            timing[1] += 1
+
+
+def count(name, n=1, unit='Count'):
+    with _lock:
+        counter = _counters.get(name)
+        if counter is None:
+            _counters[name] = [n, unit]
+        else:
+            counter[0] += n
+
+
+def set_property(name, value):
+    # Logged with the record for searching in CloudWatch Logs but not turned into a metric
+    with _lock:
+        _properties[name] = value
+
+
+def record(function):
+    # The EMF record for everything since the last flush. function becomes the metrics' only dimension
+    with _lock:
+        definitions = []
+        values = {'Function': function}
+        for phase, (ms, runs) in _timings.items():
+            definitions.append({'Name': f"{phase}_ms", 'Unit': 'Milliseconds'})
+            values[f"{phase}_ms"] = round(ms, 3)
+            if runs > 1:
+                definitions.append({'Name': f"{phase}_runs", 'Unit': 'Count'})
+                values[f"{phase}_runs"] = runs
+        for name, (total, unit) in _counters.items():
+            definitions.append({'Name': name, 'Unit': unit})
+            values[name] = total
+        for name, value in _properties.items():
+            values.setdefault(name, value)
+
+    values['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{'Namespace': NAMESPACE, 'Dimensions': [['Function']], 'Metrics': definitions}]
+    }
+    return values
+
+
+def reset():
+    with _lock:
+        _timings.clear()
+        _counters.clear()
+        _properties.clear()
+
+
+def flush(function):
+    # Sends this invocation's record to the sink and starts over for the next one
+    try:
+        _sink(record(function))
+    finally:
+        reset()
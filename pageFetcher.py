@@ -0,0 +1,213 @@
+import os
+import re
+import json
+import time
+import queue
+import codecs
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+BROWSE_URL = "http://www.bcliquorstores.com/ajax/browse"
+PAGE_SIZE = 6000
+MAX_FETCH_WORKERS = int(os.environ.get('MAX_FETCH_WORKERS', 4))  # Keep this low or BC Liquor starts throttling us
+FETCH_RETRIES = 3
+FETCH_BACKOFF = 1.0  # seconds, doubled after every failed attempt
+FETCH_TIMEOUT = 10
+STREAM_CHUNK_SIZE = 65536
+STREAM_QUEUE_SIZE = 2000  # Parsed hits waiting to be consumed, bounds memory when pages arrive faster than we use them
+
+
+def pooled_session(pool_size=MAX_FETCH_WORKERS, headers=None):
+    # requests only keeps 10 connections per host alive by default, size the pool to the worker count
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(pool_size, 10))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def fetch_page(session, page, url=BROWSE_URL, page_size=PAGE_SIZE, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF):
+    # Returns the decoded page or None if BC Liquor never gave us a good response
+    for attempt in range(retries + 1):
+        metrics.count('page_requests')
+        try:
+            res = session.get(url=url, params=dict(size=page_size, page=page), timeout=FETCH_TIMEOUT)
+            metrics.count('page_bytes', len(res.content), 'Bytes')
+            if res.status_code == 200:
+                return res.json()
+            print(f"BC Liquor returned {res.status_code} for page {page}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"BC Liquor site error on page {page}: {e}")
+
+        if attempt < retries:
+            metrics.count('page_retries')
+            time.sleep(backoff * 2**attempt)
+    return None
+
+
+def fetch_all_pages(session, url=BROWSE_URL, page_size=PAGE_SIZE, max_workers=MAX_FETCH_WORKERS):
+    # Reads the page count from page 1 then pulls the rest concurrently. Hits are returned in page order, de-duplicated by sku
+    first = fetch_page(session, 1, url=url, page_size=page_size)
+    if first is None:
+        return None
+    total_pages = first['hits']['total_pages']
+
+    pages = {1: first}
+    if total_pages > 1:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total_pages - 1))) as executor:
+            results = executor.map(lambda page: (page, fetch_page(session, page, url=url, page_size=page_size)), range(2, total_pages + 1))
+            pages.update(results)
+
+    hits = []
+    seen = set()
+    for page in range(1, total_pages + 1):
+        data = pages[page]
+        if data is None:
+            print(f"Skipping page {page} of {total_pages}, too many errors")
+            continue
+
+        # The last page will contain n elements that have already come up so that (remaining unique elements + n = pageSize).
+        # Which end they sit at isn't documented so drop them by sku rather than by position
+        for hit in data['hits']['hits']:
+            sku = hit['_source']['sku']
+            if sku not in seen:
+                seen.add(sku)
+                hits.append(hit)
+    return hits
+
+
+class HitStream:
+    # Pulls hits out of a browse page one at a time as the body arrives instead of decoding the whole 6000 hit page.
+    # Whatever surrounds the hits array (total, total_pages...) ends up in self.meta once the stream is used up
+    HITS_ARRAY = re.compile(r'"hits"\s*:\s*\[')
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.meta = None
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+        utf8 = codecs.getincrementaldecoder('utf-8')()
+        buf = ''
+        pos = 0
+
+        def read():
+            # Drops what's been parsed and appends the next chunk. False once the body is used up
+            nonlocal buf, pos
+            chunk = next(self.chunks, None)
+            buf = buf[pos:] + utf8.decode(chunk if chunk is not None else b'', final=chunk is None)
+            pos = 0
+            return chunk is not None
+
+        # The outer "hits" is an object, the inner one is the array we want
+        while (match := self.HITS_ARRAY.search(buf)) is None:
+            if not read():
+                raise ValueError("No hits array in browse page")
+        prefix = buf[:match.end() - 1]
+        pos = match.end()
+
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buf):
+                if not read():
+                    raise ValueError("Browse page ended in the middle of the hits")
+                continue
+            if buf[pos] == ']':
+                break
+            try:
+                hit, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Hit is split across chunks
+                if not read():
+                    raise
+                continue
+            pos = end
+            yield hit
+
+        pos += 1
+        while read():
+            pass
+        self.meta = json.loads(prefix + '[]' + buf[pos:])
+
+
+def counted_chunks(chunks):
+    for chunk in chunks:
+        metrics.count('page_bytes', len(chunk), 'Bytes')
+        yield chunk
+
+
+def stream_page(session, page, url=BROWSE_URL, page_size=PAGE_SIZE, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF):
+    # Yields the page's hits as they are parsed and returns the rest of the page, or None if we never got it.
+    # A retry after a dropped connection starts the page over so callers have to ignore skus they've already seen
+    for attempt in range(retries + 1):
+        metrics.count('page_requests')
+        try:
+            with session.get(url=url, params=dict(size=page_size, page=page), timeout=FETCH_TIMEOUT, stream=True) as res:
+                if res.status_code == 200:
+                    hits = HitStream(counted_chunks(res.iter_content(STREAM_CHUNK_SIZE)))
+                    yield from hits
+                    return hits.meta
+                print(f"BC Liquor returned {res.status_code} for page {page}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"BC Liquor site error on page {page}: {e}")
+
+        if attempt < retries:
+            metrics.count('page_retries')
+            time.sleep(backoff * 2**attempt)
+    print(f"Skipping page {page}, too many errors")
+    return None
+
+
+def stream_all_hits(session, url=BROWSE_URL, page_size=PAGE_SIZE, max_workers=MAX_FETCH_WORKERS):
+    # Streaming version of fetch_all_pages. Page 1 is parsed as it arrives, then the rest of the pages are streamed
+    # concurrently. Hits come out in no particular order and can repeat, skus need de-duplicating by the caller
+    meta = yield from stream_page(session, 1, url=url, page_size=page_size)
+    if meta is None or meta['hits']['total_pages'] < 2:
+        return
+
+    hits = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                hits.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def stream(page):
+        try:
+            for hit in stream_page(session, page, url=url, page_size=page_size):
+                if stop.is_set():
+                    return
+                put(hit)
+            put(None)
+        except Exception as e:
+            put(e)
+
+    pages = range(2, meta['hits']['total_pages'] + 1)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages))))
+    for page in pages:
+        executor.submit(stream, page)
+    try:
+        finished = 0
+        while finished < len(pages):
+            hit = hits.get()
+            if hit is None:
+                finished += 1
+            elif isinstance(hit, Exception):
+                raise hit
+            else:
+                yield hit
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
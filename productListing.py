@@ -0,0 +1,68 @@
+# One product as the refresh job and the search function see it. Slots instead of a __dict__ since the search function
+# keeps the whole catalogue of these in memory
+
+
+class Listing:
+    __slots__ = ('name', 'price', 'type', 'count', 'volume', 'alcPerc', 'category', 'rating', 'sku', 'value', 'adjValue', 'sale', 'image',
+                 'inventory', 'browse_fp', 'image_ok')
+
+    def __init__(self, name, price, drink_type, count, volume, alcPerc, category, rating, sku, value, adjValue, sale, image):
+        self.name = name
+        self.price = price
+        self.type = drink_type.lower() if drink_type is not None else None
+        self.count = count
+        self.volume = volume
+        self.alcPerc = alcPerc
+        self.category = category.lower() if category is not None else None
+        self.rating = rating
+        self.sku = sku
+        self.value = value
+        self.adjValue = adjValue
+        self.sale = sale
+        self.image = image
+
+        # To later store inventory (store:stock)
+        self.inventory = dict()
+        # Fingerprint of the browse fields that tell us if stock needs checking, only used by the refresh job
+        self.browse_fp = None
+        # Whether the refresh job found a working image, only used by the search function
+        self.image_ok = image is not None
+
+    def __eq__(self, other):
+        return other and self.sku == other.sku # Shouldn't be duplicate SKUs in BC liquor's stock
+
+    def __hash__(self):
+        return hash((self.sku, self.name))
+
+
+def number(text):
+    # DynamoDB sends numbers as strings with no trailing zeros, so 5.0 comes back as "5". Matches how the Decimal
+    # would have printed for the fields we only ever display
+    return float(text) if '.' in text or 'e' in text or 'E' in text else int(text)
+
+
+def string(attr):
+    # S, or None for NULL
+    return attr.get('S')
+
+
+def listing_from_wire(item):
+    # Builds a listing straight from a low-level client item ({'price': {'N': '12.99'}, ...}), skipping the
+    # TypeDeserializer and the Decimal for every number it would make
+    listing = Listing(name=item['name']['S'],
+                      price=float(item['price']['N']),
+                      drink_type=string(item['type']),
+                      count=int(item['count']['N']),
+                      volume=float(item['volume']['N']),
+                      alcPerc=number(item['alcPerc']['N']),
+                      category=string(item['category']),
+                      rating=float(item['rating']['N']),
+                      sku=int(item['sku']['N']),
+                      value=number(item['value']['N']),
+                      adjValue=float(item['adjValue']['N']),
+                      sale=float(item['sale']['N']),
+                      image=string(item['image']))
+    listing.inventory = {store: int(stock.get('S') or stock.get('N')) for store, stock in item['inventory']['M'].items()}
+    if 'image_ok' in item:
+        listing.image_ok = item['image_ok']['BOOL']
+    return listing
@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import metaStore
+
+# Finished search results, keyed on the normalised search and tagged with the catalogue version they were built from.
+# A new catalogue version makes every older entry a miss. The in memory tier lives as long as the warm container,
+# the shared tier (SHARED_RESULT_CACHE=1) keeps results in the meta table so every container can use them
+
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 256))  # Searches kept in memory per container
+SHARED_RESULT_CACHE = os.environ.get('SHARED_RESULT_CACHE', '0') == '1'
+SHARED_RESULT_TTL = int(os.environ.get('SHARED_RESULT_TTL', 86400))  # expires_at for DynamoDB's TTL to clean up old shared entries
+KEY_PREFIX = 'result#'
+
+
+def search_key(max_price, term, stores, weights=None):
+    # Searches that can only give the same results get the same key: price 0 and negative both mean no limit,
+    # the term is matched lower case, store order doesn't matter and weights are the merged ones (None for the defaults)
+    max_price = float(max_price) if max_price and float(max_price) > 0 else 0.0
+    stores = tuple(sorted(set(map(str, stores))))
+    weights = tuple(sorted(weights.items())) if weights else None
+    return (max_price, term.lower(), stores, weights)
+
+
+class ResultCache:
+    def __init__(self, size=RESULT_CACHE_SIZE, shared=SHARED_RESULT_CACHE):
+        self.size = size
+        self.shared = shared
+        self.entries = OrderedDict()  # key: result, all built from self.version
+        self.version = None
+        self.lock = threading.Lock()
+        self.stats = dict(hits=0, shared_hits=0, misses=0)
+
+    def get(self, key, version):
+        with self.lock:
+            if version != self.version:
+                # Everything we have is from an older catalogue
+                self.entries.clear()
+                self.version = version
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry
+
+        if self.shared:
+            entry = self.get_shared(key, version)
+            if entry is not None:
+                self.stats['shared_hits'] += 1
+                self.remember(key, version, entry)
+                return entry
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, version, result):
+        self.remember(key, version, result)
+        if self.shared:
+            self.put_shared(key, version, result)
+
+    def remember(self, key, version, result):
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def get_shared(self, key, version):
+        try:
+            item = metaStore.get_table().get_item(Key={'name': shared_name(key)}).get('Item')
+        except Exception as e:
+            print(f"Shared result cache read failed: {e}")
+            return None
+        if item is None or item.get('version') != version:
+            return None
+        return json.loads(item['result'])
+
+    def put_shared(self, key, version, result):
+        # Results are stored as a JSON string, Slack blocks can't go into DynamoDB as they are (floats, empty strings)
+        try:
+            metaStore.get_table().put_item(Item={'name': shared_name(key), 'version': version, 'result': json.dumps(result, separators=(',', ':')),
+                                           'expires_at': int(time.time()) + SHARED_RESULT_TTL})
+        except Exception as e:
+            print(f"Shared result cache write failed: {e}")
+
+
+def shared_name(key):
+    return KEY_PREFIX + hashlib.blake2b(json.dumps(key).encode('utf-8'), digest_size=16).hexdigest()
@@ -0,0 +1,48 @@
+# 2 minute garbage algorithm to weight value and ratings. I'm not a math major
+# Scale all values to 100 so weighting is even(?)
+DEFAULT_WEIGHTS = dict(value=0.9, rating=0.1, sale=0.2)
+# numpy is imported inside the functions that use it, the refresh job and cached searches never need it
+
+
+def adj_value(value, rating, sale, weights=DEFAULT_WEIGHTS):
+    return ((value*40)*weights['value']) + ((rating*20)*weights['rating']) + ((sale*2)*weights['sale'])
+
+
+def merge_weights(weights):
+    # Fills in whatever the user left blank with the defaults. Returns None if that leaves us with the defaults
+    if not weights:
+        return None
+    merged = dict(DEFAULT_WEIGHTS, **{k: float(v) for k, v in weights.items() if k in DEFAULT_WEIGHTS and v is not None})
+    return None if merged == DEFAULT_WEIGHTS else merged
+
+
+def scores(values, ratings, sales, weights=DEFAULT_WEIGHTS):
+    # Same as adj_value over whole numpy columns at once
+    return values * (40 * weights['value']) + ratings * (20 * weights['rating']) + sales * (2 * weights['sale'])
+
+
+def top_n(candidate_scores, n):
+    # Indexes of the n highest scores, best first. argpartition finds them without sorting everything
+    import numpy as np
+    if len(candidate_scores) > n:
+        best = np.argpartition(-candidate_scores, n - 1)[:n]
+    else:
+        best = np.arange(len(candidate_scores))
+    return best[np.argsort(-candidate_scores[best], kind='stable')]
+
+
+def bits_to_positions(mask, size):
+    # Set bits of an int bitset as a numpy array of positions
+    import numpy as np
+    if not mask:
+        return np.empty(0, dtype=np.int64)
+    raw = np.frombuffer(mask.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder='little')[:size])
+
+
+def positions_to_bits(positions, size):
+    # The other way round
+    import numpy as np
+    bits = np.zeros(size, dtype=np.uint8)
+    bits[positions] = 1
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
@@ -0,0 +1,117 @@
+import re
+import bisect
+import unicodedata
+
+# Word index over product names, types and categories. Built by the refresh job and stored as a meta blob, loaded by
+# the search function next to its product index. Terms are sorted so prefixes are a bisect away, and every term's
+# character trigrams point back at it so a misspelled word can find the terms it's close to
+
+BLOB_NAME = 'search_index'
+WORD = re.compile(r'[a-z0-9]+')
+MIN_FUZZY_LENGTH = 3  # Shorter words match too many things when we let them be misspelled
+
+
+def tokenize(text):
+    # Lower case words with accents dropped, so "Rosé" and "rose" are the same word
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return WORD.findall(text)
+
+
+def trigrams(term):
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def deltas(numbers):
+    # Sorted ids as gaps between them, small numbers compress a lot better in the blob
+    return [b - a for a, b in zip([0] + numbers, numbers)]
+
+
+def undeltas(gaps):
+    numbers, total = [], 0
+    for gap in gaps:
+        total += gap
+        numbers.append(total)
+    return numbers
+
+
+def build_index(docs):
+    # docs is (sku, [text, ...]) pairs. Returns the blob to store
+    postings = dict()  # term: set of skus
+    for sku, texts in docs:
+        for text in texts:
+            for term in tokenize(text):
+                postings.setdefault(term, set()).add(int(sku))
+
+    terms = sorted(postings)
+    grams = dict()  # trigram: term ids
+    for term_id, term in enumerate(terms):
+        for gram in trigrams(term):
+            grams.setdefault(gram, []).append(term_id)
+
+    return {
+        'terms': terms,
+        'postings': [deltas(sorted(postings[term])) for term in terms],
+        'trigrams': {gram: deltas(ids) for gram, ids in grams.items()}
+    }
+
+
+class SearchIndex:
+    def __init__(self, blob):
+        import numpy as np
+        self.terms = blob['terms']
+        self.postings = [np.cumsum(gaps, dtype=np.int64) for gaps in blob['postings']]  # sorted skus per term
+        self.trigrams = {gram: undeltas(gaps) for gram, gaps in blob['trigrams'].items()}
+
+    def prefix_matches(self, word):
+        # Term ids for the word itself and every longer term starting with it
+        start = bisect.bisect_left(self.terms, word)
+        end = start
+        while end < len(self.terms) and self.terms[end].startswith(word):
+            end += 1
+        return list(range(start, end))
+
+    def fuzzy_matches(self, word):
+        # Terms sharing a trigram with the word that are within a typo or two of it, closest ones only
+        if len(word) < MIN_FUZZY_LENGTH:
+            return []
+        limit = 1 if len(word) <= 5 else 2
+        candidates = set()
+        for gram in trigrams(word):
+            candidates.update(self.trigrams.get(gram, ()))
+
+        best, matches = limit + 1, []
+        for term_id in candidates:
+            term = self.terms[term_id]
+            if abs(len(term) - len(word)) > limit:
+                continue
+            distance = edit_distance(word, term, limit)
+            if distance > limit:
+                continue
+            if distance < best:
+                best, matches = distance, [term_id]
+            elif distance == best:
+                matches.append(term_id)
+        return matches
+
+    def lookup(self, word):
+        # Term ids a query word stands for. Misspellings are only considered when nothing starts with the word
+        return self.prefix_matches(word) or self.fuzzy_matches(word)
+
+
+def edit_distance(a, b, limit):
+    # Damerau-Levenshtein (adjacent swaps count as one edit, "vodak" is 1 from "vodka"). Anything over limit is
+    # returned as limit + 1 without finishing the table
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+    return min(current[-1], limit + 1)
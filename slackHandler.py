@@ -1,94 +1,155 @@
 import os
-import requests
-from urllib.parse import unquote
+from urllib.parse import parse_qs
 import json
-import decimal
-import boto3
 import base64
+import metrics
 
 
 MODAL = os.environ['MODAL']
 HOME_PAGE = os.environ['HOME_PAGE']
 BOT_TOKEN = os.environ["BOT_TOKEN"]
 ARN = os.environ['SEARCH_FUNCTION_ARN']
+SLACK_API_BASE = os.environ.get('SLACK_API_BASE', 'https://slack.com/api/')
+SLACK_TIMEOUT = 2.5  # Slack gives up on us after 3 seconds, so there's no point waiting on it any longer than this
+
+# Made once per container on first use and reused by every invocation after. Opening the modal doesn't need boto3 at
+# all, so a cold start can get it to Slack before the trigger expires without paying for the import
+slack = None
+lambda_client = None
+
+def get_slack():
+    # The session keeps its connection to Slack open between calls
+    global slack
+    if slack is None:
+        import requests
+        slack = requests.Session()
+        slack.headers.update({'Authorization': BOT_TOKEN})
+    return slack
+
+def get_lambda_client():
+    # The search is invoked asynchronously so the call returns as soon as Lambda has queued it, a retry would only eat our 3 seconds
+    global lambda_client
+    if lambda_client is None:
+        import boto3
+        from botocore.config import Config
+        lambda_client = boto3.client('lambda', config=Config(connect_timeout=1, read_timeout=2, retries={'max_attempts': 0}))
+    return lambda_client
+
+# Same view every time, no need to build it per request
+HOME_VIEW = json.dumps({'type': 'home',
+                        'title':
+                            {'type': 'plain_text',
+                             'text': 'Liquor Bot Home'},
+                        'blocks': HOME_PAGE})
 
 
 def open_home(user_id):
-    view = {'type': 'home',
-            'title': 
-                {'type': 'plain_text',
-                 'text': 'Liquor Bot Home'},
-                 'blocks': HOME_PAGE}
-                 
     print("Opening Home Page...")
     try:
-        req = requests.post('https://slack.com/api/views.publish', headers={'Authorization': BOT_TOKEN}, data={"token": BOT_TOKEN, "user_id": user_id, "view": json.dumps(view)})
-        
+        metrics.count('slack_posts')
+        with metrics.span('slack_post'):
+            req = get_slack().post(SLACK_API_BASE + 'views.publish', data={"token": BOT_TOKEN, "user_id": user_id, "view": HOME_VIEW}, timeout=SLACK_TIMEOUT)
+
         print(req.text)
     except Exception as e:
         print("Error occured opening home!. {}".format(e))
-    
+
 def open_modal(trigger_id):
     try:
         print("Opening Modal...")
-        req = requests.post('https://slack.com/api/views.open', headers={'Authorization': BOT_TOKEN}, data={"token": BOT_TOKEN,
-                                                                                                            "trigger_id": trigger_id,
-                                                                                                            "view": MODAL})
+        metrics.count('slack_posts')
+        with metrics.span('slack_post'):
+            req = get_slack().post(SLACK_API_BASE + 'views.open', data={"token": BOT_TOKEN,
+                                                                       "trigger_id": trigger_id,
+                                                                       "view": MODAL}, timeout=SLACK_TIMEOUT)
         print(req.text)
     except Exception as e:
         print(e)
 
 
-def lambda_handler(event, context):
-    #open_modal('1234')
-    print(f"Received event:\n{event}")
-    
-    # Sometimes body is base64 encoded
+def parse_body(event):
+    # Interactivity posts are form encoded with the JSON in a payload field, Events API posts are plain JSON.
+    # API Gateway tells us when it base64 encoded the body so there's nothing to guess
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8')
+    if body.startswith('{'):
+        return json.loads(body)
+    return json.loads(parse_qs(body)['payload'][0])
+
+
+def event_type(body):
+    # Slack doens't have a consistent place to put event type
+    if 'event' in body:
+        return body['event']['type']
+    return body['type']
+
+
+def submit_search(body):
+    values = body['view']['state']['values']
+    stores = [int(i['value']) for i in values['stores']['selected_stores']['selected_options']] # I heard you like dictionaries
+    search_term = values['search']['query']['value']
+    max_price = values['max_price']['max_price']['value']
+
+    # Optional ranking weights, anything left blank or missing from the modal uses the default
+    weights = dict()
+    for weight in ('value', 'rating', 'sale'):
+        block = values.get(f'{weight}_weight')
+        if block is not None and block[f'{weight}_weight']['value']:
+            try:
+                weights[weight] = float(block[f'{weight}_weight']['value'])
+            except ValueError:
+                print("Could not cast weights to float")
+                return {'statusCode': 500, 'body': "Weights must be numbers"}
+
     try:
-        body = json.loads(unquote(base64.b64decode(event['body']).decode('utf-8')).replace('payload=',''))
+        max_price = float(max_price)
     except:
-        body = json.loads(event['body'])
-    
-    print(body)
-    
-    # Slack doens't have a consistent place to put event type
-    if 'event' in body.keys():
-        type = body['event']['type']
-    else:
-        type = body['type']
-
-    # Modal open requests    
-    if type == 'shortcut' or (type == 'block_actions' and body['actions'][0]['value'] == 'find_liquor'):
-        open_modal(body['trigger_id'])
-    # App homepage
-    elif type == 'app_home_opened':
-        open_home(body['event']['user'])
-    # Search requests
-    elif type == 'view_submission':
-        client = boto3.client('lambda')
-        stores = [int(i['value']) for i in body['view']['state']['values']['stores']['selected_stores']['selected_options']] # I heard you like dictionaries
-        search_term = body['view']['state']['values']['search']['query']['value']
-        max_price = body['view']['state']['values']['max_price']['max_price']['value']
-
-        try:
-            max_price = float(max_price)
-        except:
-            print("Could not cast max price to float")
-            return {'statusCode': 500, 'body': "Max price must be a number"}
-
-        response = client.invoke(FunctionName=ARN,
-                             InvocationType='Event',
-                             Payload=json.dumps(
-                                 {
-                                     "max_price": max_price,
-                                     "search_term": search_term,
-                                     "stores": stores,
-                                     "response_url": body['response_urls'][0]['response_url'],
-                                     "trigger_id": body['trigger_id']
-                             }
-                             ))
-    
-
-    return {
-        'statusCode': 200
-    }
+        print("Could not cast max price to float")
+        return {'statusCode': 500, 'body': "Max price must be a number"}
+
+    with metrics.span('invoke'):
+        get_lambda_client().invoke(FunctionName=ARN,
+                                   InvocationType='Event',
+                                   Payload=json.dumps(
+                                       {
+                                           "max_price": max_price,
+                                           "search_term": search_term,
+                                           "stores": stores,
+                                           "response_url": body['response_urls'][0]['response_url'],
+                                           "trigger_id": body['trigger_id'],
+                                           "weights": weights
+                                   }
+                                   ))
+    return None
+
+
+def handle(event):
+    # Does the work for lambda_handler. Each phase goes into metrics, handling the event is timed under its type
+    with metrics.span('parse'):
+        body = parse_body(event)
+        type = event_type(body)
+    print(f"Received {type}")
+    metrics.set_property('event_type', type)
+
+    response = None
+    with metrics.span(type):
+        # Modal open requests
+        if type == 'shortcut' or (type == 'block_actions' and body['actions'][0]['value'] == 'find_liquor'):
+            open_modal(body['trigger_id'])
+        # App homepage
+        elif type == 'app_home_opened':
+            open_home(body['event']['user'])
+        # Search requests
+        elif type == 'view_submission':
+            response = submit_search(body)
+
+    return response or {'statusCode': 200}
+
+
+def lambda_handler(event, context):
+    try:
+        with metrics.span('total'):
+            return handle(event)
+    finally:
+        metrics.flush('slack')